@@ -0,0 +1,289 @@
+import os
+import re
+import sys
+import csv
+import json
+import glob
+import getopt
+
+from questionnaire.lazy import LazyModule
+
+# numpyは使うときに読み込む（--helpでは読み込まない）
+np = LazyModule("numpy")
+
+
+usage = '''analysis.py usage:
+
+全参加者の結果ファイルと条件ファイルを試行番号(trial)で結合し、条件ごとの平均・分散・回答数を計算する
+
+python analysis.py <options>
+        --result=<pattern> / -r <pattern> : 結果ファイル。{}に参加者番号が入る (default : result/result_tmp{}.csv)
+        --conditions=<pattern> / -c <pattern> : 条件ファイル。{}に参加者番号が入る (default : conditions/subject{}.csv)
+        --offset=<number> : 結果ファイルの試行番号に足す値。comp_form.pyの結果は試行番号が0始まりなので1 (default : 1)
+        --save=<path> / -s <path> : 結合した表を保存する。.npzならまとめて1ファイル、それ以外はディレクトリに列ごとの.npy
+        --summary=<file> / -o <file> : 条件ごとの集計をcsvに書き出す
+'''
+
+# 結合した表は列ごとのNumPy配列で持つ
+#   subject : 参加者番号 (int32)
+#   trial   : 試行番号 (int32)
+#   factors : 要因ごとの水準コード (int16, 条件ファイルにない試行は-1)
+#   answers : 試行 x 質問 (float64, 空欄はnan)
+#   time    : 回答した時刻 (datetime64[us], 読めなければNaT)
+#   levels  : 要因ごとの水準名（コードの順）
+class MergedTable:
+    def __init__(self, subject, trial, factor_names, factors, levels, question_names, answers, time):
+        self.subject = subject
+        self.trial = trial
+        self.factor_names = factor_names
+        self.factors = factors
+        self.levels = levels
+        self.question_names = question_names
+        self.answers = answers
+        self.time = time
+
+    def __len__(self):
+        return len(self.trial)
+
+    # path : .npzならまとめて1ファイル、それ以外はディレクトリに列ごとの.npy（np.load(mmap_mode='r')で開ける）
+    def Save(self, path):
+        columns = {"subject": self.subject, "trial": self.trial, "factors": self.factors,
+                   "answers": self.answers, "time": self.time}
+        meta = {"factor_names": self.factor_names, "levels": self.levels, "question_names": self.question_names}
+        if path.endswith(".npz"):
+            np.savez(path, meta=np.array(json.dumps(meta)), **columns)
+            return
+        os.makedirs(path, exist_ok=True)
+        for name, a in columns.items():
+            np.save(os.path.join(path, name + ".npy"), a)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    @staticmethod
+    def Load(path, mmap=True):
+        if path.endswith(".npz"):
+            data = np.load(path)
+            meta = json.loads(str(data["meta"]))
+            columns = {name: data[name] for name in ("subject", "trial", "factors", "answers", "time")}
+        else:
+            with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            columns = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r" if mmap else None)
+                       for name in ("subject", "trial", "factors", "answers", "time")}
+        return MergedTable(columns["subject"], columns["trial"], meta["factor_names"], columns["factors"],
+                           meta["levels"], meta["question_names"], columns["answers"], columns["time"])
+
+
+# csvを列ごとのリストとして読む（行ごとのdictは作らない）
+def ReadColumns(filename):
+    with open(filename, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return [], []
+        rows = []
+        skipped = 0
+        for row in reader:
+            if len(row) == len(header):
+                rows.append(row)
+            elif len(row) > 0:
+                skipped += 1
+    if skipped > 0:
+        print(f"{filename} : 列の数がヘッダと違う{skipped}行を読み飛ばしました")
+    columns = [list(c) for c in zip(*rows)] if rows else [[] for _ in header]
+    return [h.strip() for h in header], columns
+
+
+def ToFloat(values):
+    a = np.array(values, dtype=object)
+    a[a == ""] = "nan"
+    return a.astype(np.float64)
+
+
+def ToTime(values):
+    try:
+        return np.array(values, dtype="datetime64[us]")
+    except ValueError:
+        return np.array([np.datetime64(v, "us") if v else np.datetime64("NaT") for v in values], dtype="datetime64[us]")
+
+
+# 参加者番号を結果ファイル名から取り出す
+def FindSubjects(result_pattern):
+    prefix, suffix = result_pattern.split("{}")
+    regex = re.compile(re.escape(os.path.basename(prefix)) + r"(\d+)" + re.escape(suffix) + "$")
+    subjects = []
+    for filename in glob.glob(prefix + "*" + suffix):
+        m = regex.match(os.path.basename(filename))
+        if m is not None:
+            subjects.append((int)(m.group(1)))
+    return sorted(subjects)
+
+
+def Merge(result_pattern="result/result_tmp{}.csv", condition_pattern="conditions/subject{}.csv", offset=1):
+    subjects = FindSubjects(result_pattern)
+    if len(subjects) == 0:
+        raise ValueError(f"{result_pattern}に一致する結果ファイルがありません")
+
+    factor_names = []
+    level_codes = []     # 要因ごとの 水準名 -> コード
+    question_names = None
+    parts = []           # 参加者ごとの列
+
+    for subject in subjects:
+        header, columns = ReadColumns(result_pattern.format(subject))
+        if len(header) == 0 or len(columns[0]) == 0:
+            continue
+        col = {h: i for i, h in enumerate(header)}
+        q_names = [h for h in header if re.fullmatch(r"q\d+", h)]
+        if question_names is None:
+            question_names = q_names
+        elif q_names != question_names:
+            raise ValueError(f"{result_pattern.format(subject)} : 質問の列が他の参加者と違います")
+
+        trial = np.array(columns[col["trial"]], dtype=np.int32) + offset
+        answers = np.stack([ToFloat(columns[col[q]]) for q in q_names], axis=1)
+        time_col = col.get("time_stamp", col.get("time"))
+        time = ToTime(columns[time_col]) if time_col is not None else np.full(len(trial), np.datetime64("NaT"), dtype="datetime64[us]")
+
+        # 条件ファイルを試行番号で結合する（ソートして二分探索）
+        factors = {}
+        condition_file = condition_pattern.format(subject)
+        if os.path.isfile(condition_file):
+            c_header, c_columns = ReadColumns(condition_file)
+            c_trial = np.array(c_columns[c_header.index("trial")], dtype=np.int32)
+            order = np.argsort(c_trial, kind="stable")
+            pos = np.searchsorted(c_trial[order], trial)
+            pos_clip = np.minimum(pos, len(order) - 1)
+            found = (pos < len(order)) & (c_trial[order][pos_clip] == trial)
+            idx = order[pos_clip]
+            for name, values in zip(c_header, c_columns):
+                if name == "trial":
+                    continue
+                if name not in factor_names:
+                    factor_names.append(name)
+                    level_codes.append({})
+                codes = level_codes[factor_names.index(name)]
+                uniq, inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+                uniq_codes = np.array([codes.setdefault(u, len(codes)) for u in uniq.tolist()], dtype=np.int16)
+                factors[name] = np.where(found, uniq_codes[inverse.ravel()][idx], -1).astype(np.int16)
+
+        parts.append((np.full(len(trial), subject, dtype=np.int32), trial, factors, answers, time))
+
+    if len(parts) == 0:
+        raise ValueError("回答の入った結果ファイルがありません")
+
+    def factor_matrix(factors, n):
+        return np.stack([factors.get(name, np.full(n, -1, dtype=np.int16)) for name in factor_names], axis=1) \
+            if factor_names else np.zeros((n, 0), dtype=np.int16)
+
+    levels = [sorted(codes, key=codes.get) for codes in level_codes]
+    return MergedTable(
+        np.concatenate([p[0] for p in parts]),
+        np.concatenate([p[1] for p in parts]),
+        factor_names,
+        np.concatenate([factor_matrix(p[2], len(p[1])) for p in parts]),
+        levels,
+        question_names,
+        np.concatenate([p[3] for p in parts]),
+        np.concatenate([p[4] for p in parts]))
+
+
+# 要因の水準の組み合わせ（条件）ごとに質問ごとの平均・不偏分散・回答数を計算する
+# 戻り値：(条件数 x 要因数の水準コード, 平均, 分散, 回答数)、平均などは 条件数 x 質問数
+def Aggregate(table, by=None):
+    by = list(range(len(table.factor_names))) if by is None else [table.factor_names.index(b) for b in by]
+    codes = np.asarray(table.factors)[:, by].astype(np.int64) + 1   # -1(条件なし) を0にする
+    dims = [len(table.levels[i]) + 1 for i in by]
+    keys = np.ravel_multi_index(codes.T, dims) if by else np.zeros(len(table), dtype=np.int64)
+    uniq, group = np.unique(keys, return_inverse=True)
+    group = group.ravel()
+
+    answers = np.asarray(table.answers)
+    valid = ~np.isnan(answers)
+    x = np.where(valid, answers, 0.0)
+    n_group = len(uniq)
+    count = np.zeros((n_group, answers.shape[1]))
+    total = np.zeros_like(count)
+    total_sq = np.zeros_like(count)
+    np.add.at(count, group, valid)
+    np.add.at(total, group, x)
+    np.add.at(total_sq, group, x * x)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        var = (total_sq - count * mean * mean) / (count - 1)
+    group_codes = (np.array(np.unravel_index(uniq, dims)).T - 1) if by else np.zeros((n_group, 0), dtype=np.int64)
+    return group_codes, mean, var, count.astype(np.int64)
+
+
+def WriteSummary(filename, table, group_codes, mean, var, count):
+    with open(filename, "w", newline="") as f:
+        writer = csv.writer(f)
+        header = list(table.factor_names)
+        for q in table.question_names:
+            header += [f"{q}_mean", f"{q}_var", f"{q}_n"]
+        writer.writerow(header)
+        for g in range(len(group_codes)):
+            row = [table.levels[i][c] if c >= 0 else "" for i, c in enumerate(group_codes[g].tolist())]
+            for j in range(len(table.question_names)):
+                row += [mean[g, j], var[g, j], count[g, j]]
+            writer.writerow(row)
+
+
+def PrintSummary(table, group_codes, mean, var, count):
+    print('参加者：{}人、試行：{}'.format(len(np.unique(table.subject)), len(table)))
+    for g in range(len(group_codes)):
+        cond = ", ".join(f"{name}={table.levels[i][c] if c >= 0 else '-'}"
+                         for i, (name, c) in enumerate(zip(table.factor_names, group_codes[g].tolist())))
+        values = "  ".join(f"{q}: {mean[g, j]:.3f} ({var[g, j]:.3f}, n={count[g, j]})"
+                           for j, q in enumerate(table.question_names))
+        print(f"[{cond}]  {values}")
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    result_pattern = "result/result_tmp{}.csv"
+    condition_pattern = "conditions/subject{}.csv"
+    offset = 1
+    save_path = None
+    summary_filename = None
+
+    try:
+        opts, args = getopt.getopt(argv, 'hr:c:s:o:', ['help', 'result=', 'conditions=', 'offset=', 'save=', 'summary='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-r', '--result'):
+                result_pattern = arg
+            elif opt in ('-c', '--conditions'):
+                condition_pattern = arg
+            elif opt == '--offset':
+                offset = int(arg)
+            elif opt in ('-s', '--save'):
+                save_path = arg
+            elif opt in ('-o', '--summary'):
+                summary_filename = arg
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    if "{}" not in result_pattern or "{}" not in condition_pattern:
+        print(usage)
+        sys.exit()
+
+    try:
+        table = Merge(result_pattern, condition_pattern, offset)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    summary = Aggregate(table)
+    PrintSummary(table, *summary)
+    if summary_filename is not None:
+        WriteSummary(summary_filename, table, *summary)
+    if save_path is not None:
+        table.Save(save_path)
@@ -0,0 +1,217 @@
+import os
+import sys
+import csv
+import time
+import random
+import tempfile
+import getopt
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import form
+from questionnaire.result_writer import ResultWriter
+
+
+usage = '''bench_form.py usage:
+
+ウィンドウを出さずに(headless)合成したクリック列でセッションを回し、性能を計測する
+
+python benchmarks/bench_form.py <options>
+        --questions=<n,n,...> / -q <...> : 質問数 (default : 2,20,100)
+        --options=<n,n,...> / -o <...> : 1問あたりの選択肢数 (default : 7)
+        --gain=<f,f,...> / -g <...> : フォームのサイズ (default : 1.0)
+        --trials=<number> / -t <number> : 1セッションの試行数 (default : 20)
+        --moves=<number> / -m <number> : クリック間のカーソル移動回数 (default : 5)
+        --seed=<number> : 乱数のシード (default : 0)
+'''
+
+
+# 質問数と選択肢数に合わせたシート画像とform_conf.csvを作る
+def MakeSheet(dirname, question_num, option_num):
+    box = 75
+    pitch_x = 150
+    pitch_y = 180
+    left = 600
+    top = 590
+    width = max(left + pitch_x * (option_num - 1) + 400, 1984)
+    height = top + pitch_y * question_num + 300
+    img = np.full((height, width, 3), 255, dtype=np.uint8)
+
+    title = [363, 109, 499, 159]
+    cv2.rectangle(img, (title[0], title[1]), (title[2], title[3]), (0, 0, 0), 2)
+
+    button_y = top + pitch_y * question_num + 100
+    prev_area = [244, button_y, 130, 58]
+    next_area = [1052, button_y, 299, 132]
+    for cx, cy, w, h in (prev_area, next_area):
+        cv2.rectangle(img, (cx - w // 2, cy - h // 2), (cx + w // 2, cy + h // 2), (0, 0, 0), 2)
+
+    rows = []
+    for q in range(question_num):
+        cy = top + pitch_y * q
+        for i in range(option_num):
+            cx = left + pitch_x * i
+            cv2.rectangle(img, (cx - box // 2, cy - box // 2), (cx + box // 2, cy + box // 2), (0, 0, 0), 2)
+        rows.append([left, left + pitch_x * (option_num - 1), cy, box, box, option_num])
+
+    sheet = os.path.join(dirname, f"sheet_{question_num}_{option_num}.png")
+    conf = os.path.join(dirname, f"form_conf_{question_num}_{option_num}.csv")
+    cv2.imwrite(sheet, img)
+    with open(conf, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([width, height])
+        writer.writerow(title)
+        writer.writerow(prev_area)
+        writer.writerow(next_area)
+        writer.writerows(rows)
+    return sheet, conf
+
+
+# ボタンのクリック領域内のランダムな位置
+def Jitter(rng, button):
+    return (button.cx + rng.randint(-button.marginx // 2, button.marginx // 2),
+            button.cy + rng.randint(-button.marginy // 2, button.marginy // 2))
+
+
+# 1試行分のクリック列（全問回答、ときどき回答を変更、最後にnext）
+# 選択中のボタンをもう一度押すと未回答に戻るので、回答の変更では必ず別のボタンを押す
+def ClickStream(rng, template):
+    clicks = []
+    for question in template.all_questions:
+        selected = rng.randrange(question.num)
+        clicks.append(Jitter(rng, question.buttons[selected]))
+        if rng.random() < 0.2 and question.num > 1:
+            for _ in range(2):
+                selected = (selected + rng.randrange(1, question.num)) % question.num
+                clicks.append(Jitter(rng, question.buttons[selected]))
+    clicks.append(Jitter(rng, template.next_button))
+    return clicks
+
+
+def Percentile(values, p):
+    return float(np.percentile(np.asarray(values), p)) * 1000 if len(values) > 0 else float("nan")
+
+
+def RunSession(sheet, conf, gain, trial_num, move_num, seed, dirname):
+    rng = random.Random(seed)
+    t0 = time.perf_counter()
+    # 合成したシートのキャッシュは一時ディレクトリに置く（resources/.cache/に残さない）
+    template = form.FormTemplate(None, "bench", gain, conf=conf, headless=True, sheet=sheet,
+                                 cache_dir=os.path.join(dirname, ".cache"))
+    template_time = time.perf_counter() - t0
+
+    form_times = []
+    click_times = []
+    frame_times = []
+    cursor_times = []
+    records = []
+
+    for t in range(1, trial_num + 1):
+        t0 = time.perf_counter()
+        f = form.Form(template, t)
+        form_times.append(time.perf_counter() - t0)
+
+        x, y = 0, 0
+        for cx, cy in ClickStream(rng, template):
+            # クリックまでのカーソル移動
+            sx, sy = x, y
+            for i in range(move_num):
+                x = sx + (cx - sx) * (i + 1) // (move_num + 1)
+                y = sy + (cy - sy) * (i + 1) // (move_num + 1)
+                t0 = time.perf_counter()
+                f.Render(x, y)
+                cursor_times.append(time.perf_counter() - t0)
+            x, y = cx, cy
+            t0 = time.perf_counter()
+            f.Update(x, y)
+            click_times.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            f.Render(x, y)
+            frame_times.append(time.perf_counter() - t0)
+        if not f.IsGotoNextState():
+            raise RuntimeError("合成したクリック列でnextが押されませんでした")
+        data, qnum = f.GetData()
+        records.append([t] + [data[f'q{i+1}'] for i in range(qnum)] + ["2000-01-01 00:00:00"])
+
+    # 結果ファイルの書き込みスループット
+    header = ['trial'] + [f'q{i+1}' for i in range(len(template.all_questions))] + ['time_stamp']
+    write_rates = {}
+    for flush in ("row", 10, "exit"):
+        filename = os.path.join(dirname, f"result_{seed}_{flush}.csv")
+        t0 = time.perf_counter()
+        writer = ResultWriter(filename, header, flush)
+        for r in records:
+            writer.Write(r)
+        writer.Close()
+        write_rates[flush] = len(records) / (time.perf_counter() - t0)
+        os.remove(filename)
+
+    return {
+        "template_ms": template_time * 1000,
+        "form_p50": Percentile(form_times, 50),
+        "form_p95": Percentile(form_times, 95),
+        "click_p50": Percentile(click_times, 50),
+        "click_p95": Percentile(click_times, 95),
+        "frame_p50": Percentile(frame_times, 50),
+        "frame_p95": Percentile(frame_times, 95),
+        "cursor_p50": Percentile(cursor_times, 50),
+        "cursor_p95": Percentile(cursor_times, 95),
+        "write_row": write_rates["row"],
+        "write_10": write_rates[10],
+        "write_exit": write_rates["exit"],
+    }
+
+
+def Main(question_nums, option_nums, gains, trial_num, move_num, seed):
+    columns = ["questions", "options", "gain", "template_ms", "form_p50", "form_p95", "click_p50", "click_p95",
+               "frame_p50", "frame_p95", "cursor_p50", "cursor_p95", "write_row", "write_10", "write_exit"]
+    print("時間はms、write_*はrows/s")
+    print(",".join(columns))
+    with tempfile.TemporaryDirectory() as dirname:
+        for question_num in question_nums:
+            for option_num in option_nums:
+                sheet, conf = MakeSheet(dirname, question_num, option_num)
+                for gain in gains:
+                    res = RunSession(sheet, conf, gain, trial_num, move_num, seed, dirname)
+                    res.update({"questions": question_num, "options": option_num, "gain": gain})
+                    print(",".join(f"{res[c]:.3f}" if isinstance(res[c], float) else str(res[c]) for c in columns))
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    question_nums = [2, 20, 100]
+    option_nums = [7]
+    gains = [1.0]
+    trial_num = 20
+    move_num = 5
+    seed = 0
+
+    try:
+        opts, args = getopt.getopt(argv, 'hq:o:g:t:m:', ['help', 'questions=', 'options=', 'gain=', 'trials=', 'moves=', 'seed='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-q', '--questions'):
+                question_nums = [int(a) for a in arg.split(",")]
+            elif opt in ('-o', '--options'):
+                option_nums = [int(a) for a in arg.split(",")]
+            elif opt in ('-g', '--gain'):
+                gains = [float(a) for a in arg.split(",")]
+            elif opt in ('-t', '--trials'):
+                trial_num = int(arg)
+            elif opt in ('-m', '--moves'):
+                move_num = int(arg)
+            elif opt == '--seed':
+                seed = int(arg)
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    Main(question_nums, option_nums, gains, trial_num, move_num, seed)
@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import getopt
+import subprocess
+
+
+usage = '''bench_import.py usage:
+
+各スクリプトの --help と共有パッケージのimportにかかる時間を、新しいPythonプロセスで計測する
+あわせて、その経路でcv2やnumpyが読み込まれたかを表示する
+
+python benchmarks/bench_import.py <options>
+        --repeat=<number> / -n <number> : 1つあたりの計測回数 (default : 10)
+'''
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+heavy_modules = ("cv2", "numpy")
+
+# 終わったときに読み込まれていた重いモジュールをstderrに書く
+report = "\nsys.stderr.write(' '.join(m for m in {!r} if m in sys.modules))\n".format(heavy_modules)
+
+
+def HelpCode(script):
+    return ("import sys, runpy\n"
+            f"sys.argv = [{script!r}, '--help']\n"
+            "try:\n"
+            f"    runpy.run_path({script!r}, run_name='__main__')\n"
+            "except SystemExit:\n"
+            "    pass" + report)
+
+
+cases = [
+    ("python (空)", "import sys" + report),
+    ("import questionnaire.*", "import sys\nimport questionnaire.widgets, questionnaire.layout, questionnaire.result_writer, "
+                               "questionnaire.conditions, questionnaire.mouse_input, questionnaire.trajectory, "
+                               "questionnaire.instrument, questionnaire.sheet_cache" + report),
+    ("form.py --help", HelpCode("form.py")),
+    ("comp_form.py --help", HelpCode("comp_form.py")),
+    ("web_form.py --help", HelpCode("web_form.py")),
+    ("analysis.py --help", HelpCode("analysis.py")),
+    ("omr.py --help", HelpCode("omr.py")),
+]
+
+
+def Run(code):
+    start = time.perf_counter()
+    p = subprocess.run([sys.executable, "-c", code], cwd=root, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if p.returncode != 0:
+        raise RuntimeError(p.stderr)
+    return elapsed, p.stderr.strip().splitlines()[-1] if p.stderr.strip() else ""
+
+
+def Bench(repeat):
+    print(f"{'case':<24}{'p50[ms]':>10}{'min[ms]':>10}  loaded")
+    for name, code in cases:
+        times = []
+        loaded = ""
+        for _ in range(repeat):
+            elapsed, loaded = Run(code)
+            times.append(elapsed * 1000)
+        times.sort()
+        print(f"{name:<24}{times[len(times) // 2]:>10.1f}{times[0]:>10.1f}  {loaded or '-'}")
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    repeat = 10
+
+    try:
+        opts, args = getopt.getopt(argv, 'hn:', ['help', 'repeat='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-n', '--repeat'):
+                repeat = int(arg)
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    Bench(repeat)
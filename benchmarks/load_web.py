@@ -0,0 +1,136 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import getopt
+
+
+usage = '''load_web.py usage:
+
+web_form.py のサーバーに、N人の参加者が同時に回答する負荷をかけてリクエストの応答時間を計測する
+（ブラウザの代わりのクライアント。事前に python web_form.py -t <試行数> でサーバーを起動しておく）
+
+python benchmarks/load_web.py <options>
+        --clients=<number> / -n <number> : 同時に回答する参加者数 (default : 30)
+        --host=<address> : サーバーのアドレス (default : 127.0.0.1)
+        --port=<number> / -p <number> : ポート番号 (default : 8080)
+        --user=<number> / -u <number> : 最初の参加者番号。ここから連番で使う (default : 1001)
+        --think=<ms> : クリックの間隔 (default : 0)
+        --seed=<number> : 乱数のシード (default : 0)
+'''
+
+
+# keep-aliveで1本の接続を使い回す最小限のHTTPクライアント
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.latencies = []
+
+    async def Request(self, method, path):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        start = time.perf_counter()
+        self.writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: 0\r\n\r\n".encode())
+        await self.writer.drain()
+        status = (await self.reader.readline()).split()[1]
+        length = 0
+        while True:
+            h = await self.reader.readline()
+            if h in (b"\r\n", b""):
+                break
+            k, v = h.decode().split(":", 1)
+            if k.strip().lower() == "content-length":
+                length = int(v)
+        body = await self.reader.readexactly(length)
+        self.latencies.append(time.perf_counter() - start)
+        if status != b"200":
+            raise RuntimeError(f"{method} {path} : {status.decode()}")
+        return body
+
+    def Close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def Participant(host, port, user, layout, think, rng):
+    client = Client(host, port)
+    try:
+        state = json.loads(await client.Request("POST", f"/session?user={user}"))
+        session = state["session"]
+        while not state["done"]:
+            # 全問にランダムに回答してnextを押す
+            for q, buttons in enumerate(layout["questions"]):
+                if state["answers"][q] >= 0:
+                    continue
+                l, t, r, b = buttons[rng.randrange(len(buttons))]
+                state = json.loads(await client.Request("POST", f"/click?session={session}&x={(l + r) // 2}&y={(t + b) // 2}"))
+                if think > 0:
+                    await asyncio.sleep(think / 1000)
+            l, t, r, b = layout["next"]
+            state = json.loads(await client.Request("POST", f"/click?session={session}&x={(l + r) // 2}&y={(t + b) // 2}"))
+    finally:
+        client.Close()
+    return client.latencies
+
+
+def Percentile(values, p):
+    values = sorted(values)
+    return values[min((int)(len(values) * p / 100), len(values) - 1)] * 1000
+
+
+async def Main(client_num, host, port, first_user, think, seed):
+    client = Client(host, port)
+    layout = json.loads(await client.Request("GET", "/layout"))
+    client.Close()
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        Participant(host, port, first_user + i, layout, think, random.Random(seed + i)) for i in range(client_num)])
+    elapsed = time.perf_counter() - start
+
+    latencies = [v for r in results for v in r]
+    print(f"参加者：{client_num}人、リクエスト：{len(latencies)}回、{elapsed:.2f}s（{len(latencies) / elapsed:.0f} req/s）")
+    print(f"応答時間 p50={Percentile(latencies, 50):.2f}ms p95={Percentile(latencies, 95):.2f}ms "
+          f"p99={Percentile(latencies, 99):.2f}ms max={max(latencies) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    client_num = 30
+    host = "127.0.0.1"
+    port = 8080
+    first_user = 1001
+    think = 0
+    seed = 0
+
+    try:
+        opts, args = getopt.getopt(argv, 'hn:p:u:', ['help', 'clients=', 'host=', 'port=', 'user=', 'think=', 'seed='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-n', '--clients'):
+                client_num = int(arg)
+            elif opt == '--host':
+                host = arg
+            elif opt in ('-p', '--port'):
+                port = int(arg)
+            elif opt in ('-u', '--user'):
+                first_user = int(arg)
+            elif opt == '--think':
+                think = int(arg)
+            elif opt == '--seed':
+                seed = int(arg)
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    asyncio.run(Main(client_num, host, port, first_user, think, seed))
@@ -1,330 +1,54 @@
-import numpy as np
-import copy
-import os
 import csv
 import datetime
-import cv2
 
 import getopt
 import sys
 
+from questionnaire.lazy import LazyModule
+from questionnaire.result_writer import ResultWriter, LastTrial
+from questionnaire.conditions import ConditionFile
+from questionnaire.trajectory import TrajectoryRecorder
+from questionnaire.mouse_input import MouseInput
+from questionnaire.calibration import FindBoxEdges
+from questionnaire.window import WaitInterval
+from form import FormTemplate, Form, idle_wait_ms
+
+# cv2とnumpyは使うときに読み込む（--helpなどでは読み込まない）
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+
 # from socket import socket, AF_INET, SOCK_DGRAM
 # def send_msg(msg):
 #     s = socket(AF_INET, SOCK_DGRAM) # 通信する場合
 #     s.sendto(msg.encode(), ("100.80.145.215", 52525))
 #     s.close()
 
+# 試行間の白い画面の時間[ms]
+iti_ms = 500
+
 
 usage = '''comp_form.py usage:
 
 python comp_form.py <options>
-        --user=<number>  1~
-        --trial=<number>  (default : 0)
+        --user=<number> / -u <number> : 参加者番号 1~
+        --start=<number> / -s <number> : startする試行番号 (default : 1)
+        --resume / -r : 結果ファイルの最後の試行の次から再開する（途中で落ちたとき用）
+        --trial=<number> / -t <number> : 以前の書き方。0始まりの試行番号で--startと同じ
+        --traj : マウスの軌跡をすべて記録し、試行ごとに result/result_tmp<N>_traj.bin に書き出す
 '''
 
-##################################
-## sheet parameter
-##################################
-
-# トグルボタン
-class Button:
-    def __init__(self, center_x, center_y, width, height, text="", margin_gain=1.0):
-        self.cx = center_x
-        self.cy = center_y
-        self.minx = (int)(center_x - width / 2 + 0.5)
-        self.maxx = (int)(center_x + width / 2 + 0.5)
-        self.miny = (int)(center_y - height / 2 + 0.5)
-        self.maxy = (int)(center_y + height / 2 + 0.5)
-        self.state = False
-        self.text = text
-        # ボタン中心からどれだけ離れた範囲をクリック領域とみなすか
-        self.margin_gain = margin_gain
-        self.marginx = (int)(width / 2 * self.margin_gain + 0.5) 
-        self.marginy = (int)(height / 2 * self.margin_gain + 0.5)
-
-    def State(self):
-        return self.state
-    
-    def SetState(self, state):
-        self.state = state
-
-    # 戻り値：ステータス変更！
-    def UpdateState(self, x, y):
-        if not self.IsClick(x, y):
-            return False 
-        self.state = not self.state
-        return True
-    
-    def IsClick(self, x, y):
-        if x < self.cx - self.marginx or x > self.cx + self.marginx or y < self.cy - self.marginy or y > self.cy + self.marginy:
-            return False
-        else:
-            return True
-
-    def Render(self, target_img, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color = (0, 0, 0)):
-        color = on_color if self.state else off_color
-        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), color, thickness=-1)
-        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), border_color)
-        if self.text == "":
-            return
-        (w, h), baseline = cv2.getTextSize(self.text, cv2.FONT_HERSHEY_SIMPLEX, 1, 1)
-        x1 = (int)(self.cx - w / 2 + 0.5)
-        y1 = (int)(self.cy + h / 5 + 0.5)
-        cv2.putText(target_img, self.text, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2)
-
-    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
-        cv2.rectangle(target_img, (self.cx - self.marginx, self.cy - self.marginy), 
-                    (self.cx + self.marginx, self.cy + self.marginy), color, thickness=-1)
-
-
-
-# グループボタン、どれか一個しかONにならない
-class RadioButton:
-    # buttons : class Button
-    def __init__(self, buttons):
-        self.num = len(buttons)
-        self.buttons = [b for b in buttons]
-
-    def SetAllFalse(self):
-        for b in self.buttons:
-            b.SetState(False)
-            
-    def UpdateState(self, x, y):
-        for b in self.buttons:
-            # ボタンのステートが変われば
-            if b.UpdateState(x, y):
-                now_state = b.State()
-                self.SetAllFalse()
-                b.SetState(now_state)
-
-    # -1 : All False, 0 ~ num-1 : buttons[xx] is True
-    def State(self):
-        ret_val = None
-        for i, b in enumerate(self.buttons):
-            if b.State():
-                ret_val = i
-        return ret_val
-
-    def Render(self, target_img, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color=(0, 0, 0)):
-        for b in self.buttons:
-            b.Render(target_img, on_color, off_color, border_color, text_color)
-
-    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
-        for b in self.buttons:
-            b.RenderMarginArea(target_img, color)
-
-# 二次元マップ
-class Map:
-    def __init__(self, center_x, center_y, width, height, margin_gain=1.0):
-        self.cx = center_x
-        self.cy = center_y
-        self.minx = (int)(center_x - width / 2 + 0.5)
-        self.maxx = (int)(center_x + width / 2 + 0.5)
-        self.miny = (int)(center_y - height / 2 + 0.5)
-        self.maxy = (int)(center_y + height / 2 + 0.5)
-        self.state = False
-        # ボタン中心からどれだけ離れた範囲をクリック領域とみなすか
-        self.margin_gain = margin_gain
-        self.marginx = (int)(width / 2 * self.margin_gain + 0.5) 
-        self.marginy = (int)(height / 2 * self.margin_gain + 0.5)
-        self.posX = None
-        self.posY = None
-    
-    # 戻り値：ステータス変更！
-    def UpdateState(self, x, y):
-        if not self.IsClick(x, y):
-            return False 
-        self.posX = self.maxx if x > self.maxx else self.minx if x < self.minx else x
-        self.posY = self.maxy if y > self.maxy else self.miny if y < self.miny else y
-        return True
-    
-    def IsClick(self, x, y):
-        if x < self.cx - self.marginx or x > self.cx + self.marginx or y < self.cy - self.marginy or y > self.cy + self.marginy:
-            return False
-        else:
-            return True
-
-    def Render(self, target_img, color = (0, 0, 255), point_size = 5):
-        if self.posX == None or self.posY == None:
-            return 
-        cv2.circle(target_img, (self.posX, self.posY), point_size, color, thickness=-1)
-
-    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
-        cv2.rectangle(target_img, (self.cx - self.marginx, self.cy - self.marginy), 
-                    (self.cx + self.marginx, self.cy + self.marginy), color, thickness=-1)
-
-    # -1 ~ 1, -1 ~ 1で返す
-    def State(self):
-        if self.posX == None or self.posY == None:
-            return (None, None)
-        xvalue = -1 + 2 * (self.posX - self.minx) / (self.maxx - self.minx)
-        yvalue = -1 * (-1 + 2 * (self.posY - self.miny) / (self.maxy - self.miny))
-        return (xvalue, yvalue)
-
-
-
-
-
-# フォーム
-class Form:
-    def __init__(self, back_img, window_name, trial_num, size=1.5):
-        f = lambda a:(int)(a * size + 0.5)
-
-        if not os.path.isfile("./resources/form_conf.csv"):
-            print("resources/form_conf.csvがありません")
-            sys.exit()
-        with open("./resources/form_conf.csv", "r") as z:
-            reader = csv.reader(z)
-            dummy = [row for row in reader]
-            imgw = (int)(dummy[0][0])
-            imgh = (int)(dummy[0][1])
-            t = {"x":(int)(dummy[1][0]), "y":(int)(dummy[1][1]), "w":(int)(dummy[1][2]), "h":(int)(dummy[1][3])}
-            p = {"x":(int)(dummy[2][0]), "y":(int)(dummy[2][1]), "w":(int)(dummy[2][2]), "h":(int)(dummy[2][3])}
-            n = {"x":(int)(dummy[3][0]), "y":(int)(dummy[3][1]), "w":(int)(dummy[3][2]), "h":(int)(dummy[3][3])}
-            g = [{"x1":(int)(row[0]), "x2":(int)(row[1]), "y":(int)(row[2]), "w":(int)(row[3]), "h":(int)(row[4])} for row in dummy[4:]]
-
-        self.form_width = f(imgw)
-        self.form_height = f(imgh)
-
-        self.img = copy.deepcopy(back_img)
-        self.img = cv2.resize(self.img, (self.form_width, self.form_height))
-        self.window_name = window_name
-        cv2.namedWindow(self.window_name)
-        cv2.moveWindow(self.window_name, 0, 0)
-        self.trial_num = trial_num
-        cv2.rectangle(self.img, (f(t['x']) - 2, f(t['y'] - t['h'] / 2) - 2), (f(t['x'] + t['w']) + 2, f(t['y'] + t['h'] / 2) + 2), (255, 255, 255), -1)
-        cv2.putText(self.img, "Trial : " + str(trial_num + 1), (f(t['x']), f(t['y'])), cv2.FONT_HERSHEY_SIMPLEX, 1.5, (0, 0, 0), 3)
-
-        self.all_questions = []
-        idx = 0
-
-        # Question1
-        buttons_num = 7
-        buttons_width = f(g[idx]["w"])  
-        buttons_height = f(g[idx]["h"])    
-        q2_yc = f(g[idx]["y"])          
-        q2_xmin = f(g[idx]["x1"])
-        q2_xmax = f(g[idx]["x2"]) 
-        q2_xcs = [int(q2_xmin + i * (q2_xmax - q2_xmin) / (buttons_num - 1) + 0.5) for i in range(buttons_num)]
-        buttons = []
-        for i in range(buttons_num):
-            buttons.append(Button(q2_xcs[i], q2_yc, buttons_width, buttons_height, margin_gain=2.4))
-        self.question1 = RadioButton(buttons)
-        idx += 1
-        self.all_questions.append(self.question1)
-
-        # Question2
-        buttons_num = 7
-        buttons_width = f(g[idx]["w"]) 
-        buttons_height = f(g[idx]["h"]) 
-        q2_yc = f(g[idx]["y"]) 
-        q2_xmin = f(g[idx]["x1"]) 
-        q2_xmax = f(g[idx]["x2"]) 
-        q2_xcs = [int(q2_xmin + i * (q2_xmax - q2_xmin) / (buttons_num - 1) + 0.5) for i in range(buttons_num)]
-        buttons = []
-        for i in range(buttons_num):
-            buttons.append(Button(q2_xcs[i], q2_yc, buttons_width, buttons_height, margin_gain=2.4))
-        self.question2 = RadioButton(buttons)
-        idx += 1
-        self.all_questions.append(self.question2)
-
-        # # # Question3
-        # buttons_num = 7
-        # buttons_width = f(g[idx]["w"]) 
-        # buttons_height = f(g[idx]["h"]) 
-        # q2_yc = f(g[idx]["y"])
-        # q2_xmin = f(g[idx]["x1"]) 
-        # q2_xmax = f(g[idx]["x2"]) 
-        # q2_xcs = [int(q2_xmin + i * (q2_xmax - q2_xmin) / (buttons_num - 1) + 0.5) for i in range(buttons_num)]
-        # buttons = []
-        # for i in range(buttons_num):
-        #     buttons.append(Button(q2_xcs[i], q2_yc, buttons_width, buttons_height, margin_gain=2.4))
-        # self.question3 = RadioButton(buttons)
-        # idx += 1
-        # self.all_questions.append(self.question3)
-
-        # Prev
-        self.prev_button = Button(f(p['x']), f(p['y']), f(p['w']), f(p['h']), "prev")
-        # Next
-        self.next_button = Button(f(n['x']), f(n['y']), f(n['w']), f(n['h']), "next")
-
-    def Update(self, x, y):
-        can_push_next = True
-        for question in self.all_questions:
-            question.UpdateState(x, y)
-            if question.State() == None:
-                can_push_next = False
-        self.prev_button.UpdateState(x, y)
-        if can_push_next:
-            self.next_button.UpdateState(x, y)
-
-    def RenderAll(self, x, y):
-        tmp = copy.deepcopy(self.img)
-        can_push_next = True
-        for question in self.all_questions:
-            question.Render(tmp)
-            if question.State() == None:
-                can_push_next = False
-        self.prev_button.Render(tmp)
-        text_color = (0, 0, 0) if can_push_next else (230, 230, 230) 
-        self.next_button.Render(tmp, text_color=text_color)
-        # カーソルの描画
-        cv2.circle(tmp, (x, y), 5, (0, 255, 255), thickness=-1)
-        cv2.imshow(self.window_name, tmp)
-        return cv2.waitKey(3)
-    
-    def IsGotoPrevState(self):
-        return self.prev_button.State()
-
-    def IsGotoNextState(self):
-        return self.next_button.State()
-    
-    def GetData(self):
-        row = {}
-        for i, question in enumerate(self.all_questions):
-            row[f'q{i+1}'] = question.State()
-        return row
-
-    def SetMouseEvent(self, func):
-        # マウスイベント時に関数mouse_touch_flagの処理を行う
-        cv2.setMouseCallback(self.window_name, func)
-
-
-global _x
-global _y
-global _touch_flag
-_x = 500
-_y = 500
-_touch_flag = False
+# マウス入力（コールバックが積み、ループが取り出す）
+_mouse = MouseInput()
+_trajectory = None   # --trajのときのTrajectoryRecorder
 
 # マウスイベント
 def __mouse_event(event, x, y, flag, params):
-    global _x
-    global _y
-    global _touch_flag
-    _x = x
-    _y = y
-    if event == cv2.EVENT_LBUTTONDOWN:
-        _touch_flag = True
-
-
-def LoadConditionFile(file_name):
-    i2j = []
-    with open(file_name, 'r', newline='') as f:
-        reader = csv.reader(f)
-        dummy = [row for row in reader]
-
-        for d in dummy[1:]:
-            row = {'trial':(int)(d[0]), 'Factor1':d[1], 'Factor2':d[2]}
-            i2j.append(row)
-    print(i2j)
-    return i2j
+    if _trajectory is not None:
+        _trajectory.Record(event, x, y)
+    _mouse.Push(event, x, y, flag)
 
 
 def FindFormParameter():
-    global _x
-    global _y
-    global _touch_flag
     sheet_name = './resources/sheet.png'
     img = cv2.imread(sheet_name)
     cv2.namedWindow("debug")
@@ -341,16 +65,19 @@ def FindFormParameter():
     cv2.rectangle(img, (0, 0), (thx, thy), (255, 255, 0))
     cands = [[-1, -1]]
 
-    while True:
+    exit_flag = False
+    while not exit_flag:
+        for event, x, y, flags, t_ns in _mouse.Drain():
+            if event != cv2.EVENT_LBUTTONDOWN:
+                continue
+            if x < thx and y < thy:
+                exit_flag = True
+                break
+            cands.append([x, y])
+            cv2.circle(img, (x, y), 5, (0, 0, 255), -1)
         bar_img = img.copy()
-        cv2.circle(bar_img, (_x, _y), 5, (0, 255, 0), -1)
+        cv2.circle(bar_img, (_mouse.x, _mouse.y), 5, (0, 255, 0), -1)
         cv2.imshow("debug", bar_img)
-        if _touch_flag:
-            if _x < thx and _y < thy:
-                break
-            cands.append([_x, _y])
-            cv2.circle(img, (_x, _y), 5, (0, 0, 255), -1)
-            _touch_flag = False
         cv2.waitKey(5)
     cv2.destroyWindow("debug")
 
@@ -361,18 +88,7 @@ def FindFormParameter():
     for i in range(0, len(cands), 2):
         for j in range(2):
             p = cands[i + j]
-            top = p[1]
-            bot = p[1]
-            left = p[0]
-            right = p[0]
-            while img[top, p[0], 0] > 250:
-                top -= 1
-            while img[bot, p[0], 0] > 250:
-                bot += 1
-            while img[p[1], left, 0] > 250:
-                left -= 1
-            while img[p[1], right, 0] > 250:
-                right += 1
+            left, right, top, bot = FindBoxEdges(img, p[0], p[1])
             box_width = right - left
             box_height = bot - top
             if i == 0:
@@ -402,84 +118,118 @@ def FindFormParameter():
 
 
 
-def Play(subject_num, start_num = 0):
-    global _x
-    global _y
-    global _touch_flag
-
-    header = ["trial", "Factor1", "Factor2", "q1", "q2", "time"]
-
-    conds = copy.deepcopy(LoadConditionFile('conditions/subject{}.csv'.format(subject_num)))
-    trial_num = len(conds)  #.shape[0]    
+# start_num : 0始まりの試行番号
+# resume    : Trueなら結果ファイルの最後の試行の次から始める
+def Play(subject_num, start_num = 0, traj = False, resume = False):
+    global _trajectory
+    try:
+        conds = ConditionFile('conditions/subject{}.csv'.format(subject_num))
+    except ValueError as e:
+        print(e)
+        sys.exit()
+    trial_num = conds.TrialNum()
+    if resume:
+        # 結果ファイルの試行番号は0始まりなので、最後の試行の次は+1
+        last = LastTrial('result/result_tmp{}.csv'.format(subject_num))
+        start_num = 0 if last is None else last + 1
+        if start_num >= trial_num:
+            print('参加者：{}人目は全{}試行を終えています'.format(subject_num, trial_num))
+            conds.Close()
+            return
+    header = ["trial"] + conds.factor_names + ["q1", "q2", "time"]
     print('参加者：{}人目、試行回数：{}回、{}試行目からスタート'.format(subject_num, trial_num, start_num + 1))
     t = start_num
 
-    img = cv2.imread('./resources/sheet.png')
+    # フォームはform.pyと同じもの（イベント駆動で、変わったところだけを描き直す）を使う
     window_name = 'target'
-    res = []
+    template = FormTemplate(None, window_name, 0.9, conf="./resources/form_conf.csv", sheet="./resources/sheet.png",
+                            fmt="comp", question_num=2, trial_label="Trial : {}", window_pos=(0, 0))
+
+    # 結果ファイルはセッション中ずっと開いておく
+    try:
+        writer = ResultWriter('result/result_tmp{}.csv'.format(subject_num), header)
+    except ValueError as e:
+        print(e)
+        conds.Close()
+        sys.exit()
+    if traj:
+        _trajectory = TrajectoryRecorder('result/result_tmp{}_traj.bin'.format(subject_num))
+    try:
+        PlayTrials(template, writer, conds, trial_num, t)
+    finally:
+        writer.Close()
+        conds.Close()
+        _trajectory = None
+        cv2.destroyAllWindows()
 
 
+def PlayTrials(template, writer, conds, trial_num, start_num):
+    t = start_num
+    template.OpenWindow(__mouse_event)
+
     while t < trial_num:
-        form = Form(img, window_name, t, size=0.9)
-        form.SetMouseEvent(__mouse_event)
+        form = Form(template, t + 1)
+        if _trajectory is not None:
+            _trajectory.Reset()
+        # 前の試行の画面を閉じてからのクリックはこの試行の回答にしない
+        _mouse.Clear()
 
         while not form.IsGotoNextState() and not form.IsGotoPrevState():
-            if _touch_flag:
-                form.Update(_x, _y)
-                _touch_flag = False
-            ans = form.RenderAll(_x, _y)
+            # 前のフレームから溜まったクリックをすべて処理する
+            for event, x, y, flags, t_ns in _mouse.Drain():
+                if event != cv2.EVENT_LBUTTONDOWN:
+                    continue
+                form.Update(x, y, t_ns)
+                # prevかnextが押されたら残りは処理しない
+                if form.IsGotoNextState() or form.IsGotoPrevState():
+                    break
+            # 変わったところだけを描き直し、何も起きなければwaitKeyで入力を待つ
+            ans = form.Render(_mouse.x, _mouse.y, idle_wait_ms)
 
             # if ans == 49:
             #     send_msg(f"a,o,1,end")
             # elif ans == 50:
             #     send_msg(f"a,o,2,end")
 
-        cv2.destroyAllWindows()
-
         # 前に戻るボタンがONならこの試行の結果を無視して前に戻る
         if form.IsGotoPrevState():
             if t != 0:
                 t += -1
             # send_msg(f"a,n,{t + 1},end")
-            cv2.waitKey(500)
+            WaitInterval(template.window_name, template.blank_img, iti_ms, idle_wait_ms)
             continue
 
-        _data = form.GetData()
+        # 7段階尺度を-3～3にする
+        _data, _qnum = form.GetData(True)
 
         dt = datetime.datetime.now()
-        record = [t, conds[t]['Factor1'], conds[t]['Factor2'], \
-            _data['q1'] - 3, _data['q2'] - 3, dt]
-        res.append(record)
-
-        if not os.path.isfile('result/result_tmp{}.csv'.format(subject_num)):
-            with open('result/result_tmp{}.csv'.format(subject_num), 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(header)
-        with open('result/result_tmp{}.csv'.format(subject_num), 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(record)
+        # 試行番号は以前の結果ファイルと同じく0始まりで書く（追記や--resumeで番号が混ざらないように）
+        # 条件ファイルのtrialは1始まりなので、analysis.pyは1を足して結合する
+        factors = conds.Get(t + 1)
+        record = [t] + [factors[name] for name in conds.factor_names] + \
+            [_data['q1'], _data['q2'], dt]
+        writer.Write(record)
+        if _trajectory is not None:
+            _trajectory.Flush(t)
 
         # 結果を送信する
         # send_msg(f"a,n,{t+2},end")
 
         ###########################
-        cv2.waitKey(500)
+        WaitInterval(template.window_name, template.blank_img, iti_ms, idle_wait_ms)
         t += 1        
 
-    # with open('result/result{}.csv'.format(subject_num), 'w', newline='') as f:
-    #     writer = csv.writer(f)
-    #     writer.writerow(header)
-    #     writer.writerows(res)
-
 
 
 if __name__ == '__main__':
     argv = sys.argv[1:]
     subject_num = None
-    trial_num = 0
+    start_num = 0
+    traj = False
+    resume = False
 
     try:
-        opts, args = getopt.getopt(argv, 'h:u:t:d:', ['help', 'user=', 'trial=', 'debug'])
+        opts, args = getopt.getopt(argv, 'h:u:s:t:d:r', ['help', 'user=', 'start=', 'trial=', 'debug', 'traj', 'resume'])
     except getopt.GetoptError:
         print(usage)
         sys.exit()
@@ -491,13 +241,22 @@ if __name__ == '__main__':
             if opt in ('-d', '--debug'):
                 FindFormParameter()
                 sys.exit()
+            elif opt == '--traj':
+                traj = True
             elif opt in ('-u', '--user'):
                 subject_num = int(arg)
+            elif opt in ('-s', '--start'):
+                start_num = int(arg) - 1
+                if start_num < 0:
+                    print(usage)
+                    sys.exit()
             elif opt in ('-t', '--trial'):
-                trial_num = int(arg)
-                if trial_num < 0:
+                start_num = int(arg)
+                if start_num < 0:
                     print(usage)
                     sys.exit()
+            elif opt in ('-r', '--resume'):
+                resume = True
         except Exception:
             print('Error parsing argument: %s' % opt)
             print(usage)
@@ -505,4 +264,4 @@ if __name__ == '__main__':
     if subject_num == None or subject_num <= 0:
         print(usage)
         sys.exit()
-    Play(subject_num, trial_num)
\ No newline at end of file
+    Play(subject_num, start_num, traj, resume)
\ No newline at end of file
@@ -1,13 +1,28 @@
 from traceback import format_exception_only
-import numpy as np
-import copy
 import os
 import csv
 import datetime
-import cv2
 
 import getopt
 import sys
+import time
+import glob
+
+from questionnaire.lazy import LazyModule
+from questionnaire.widgets import Button, RadioButton, ClickIndex, BlitSprite, RestoreRegion
+from questionnaire.result_writer import LastTrial
+from questionnaire.answer_store import AnswerStore, LogFilename
+from questionnaire.layout import LoadLayout
+from questionnaire.sheet_cache import LoadSheet
+from questionnaire.instrument import Instrumentation, NullInstrumentation
+from questionnaire.mouse_input import MouseInput
+from questionnaire.calibration import FindBoxEdges, CountButtons
+from questionnaire import window
+
+# cv2、numpyなど読み込みに時間がかかるものは使うときに読み込む（--helpなどでは読み込まない）
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+futures = LazyModule("concurrent.futures")
 
 
 usage = '''form.py usage:
@@ -16,9 +31,16 @@ python form.py <options>
         --user=<number> / -u <number> : 参加者番号 1~
         --trial_num=<number> / -t <number> : 全試行数
         --start=<number> / -s <number> : startする試行番号 (default : 1)
+        --resume / -r : 結果ファイルの最後の試行の次から再開する（途中で落ちたとき用）
         --gain=<float> / -g <float> : フォームのサイズ（default : 1）
         --zmean=<0 or 1> / -z <0 or 1> : 7段階尺度を(0)0～6にするか(1)-3～3にするか（default : 1）
-        --debug / -d : シートパラメータの設定
+        --flush=<row, number or exit> / -f <...> : 結果ファイルをディスクへ同期するタイミング。1行ごと、N行ごと、終了時（default : row）
+        --iti=<ms> : 試行と試行の間に白い画面を出す時間[ms]（default : 500）
+        --viewport=<pixels> : ウィンドウの高さ[px]。シートが縦に長いときに、見えている部分だけを表示してマウスホイールか矢印キー/PageUp/PageDown/Home/Endでスクロールする
+        --instrument / -i : クリックから再描画までの時間などを計測し、result/result<番号>_timing.csvに書き出す
+        --auto / -a : シートパラメータの自動設定（枠を自動検出する）
+        --batch=<dir> / -b <dir> : dir内のシート画像をまとめて自動設定する（<name>_conf.csvを作成）
+        --debug / -d : シートパラメータの設定（クリックで指定する）
 '''
 
 f_resource = "./resources/"
@@ -28,232 +50,450 @@ f_result = "./result/"
 result_prename = f_result + "result"
 result_etcname = ".csv"
 
+# イベント駆動描画で入力待ちするときの待ち時間[ms]
+idle_wait_ms = 15
+# カーソルの半径
+cursor_radius = 5
+# 試行間の白い画面の時間[ms]
+default_iti_ms = 500
+# スクロールに使うキー。cv2.waitKeyExが返すコード（GTK、Windows、Qt、macOSの順）
+# GTK版のOpenCVではマウスホイールのイベントが来ないので、キーボードでもスクロールできるようにする
+scroll_keys = {
+    65362: "up", 2490368: "up", 0x1000013: "up", 63232: "up",
+    65364: "down", 2621440: "down", 0x1000015: "down", 63233: "down",
+    65365: "pageup", 2162688: "pageup", 0x1000016: "pageup", 63276: "pageup",
+    65366: "pagedown", 2228224: "pagedown", 0x1000017: "pagedown", 63277: "pagedown",
+    65360: "home", 2359296: "home", 0x1000010: "home", 63273: "home",
+    65367: "end", 2293760: "end", 0x1000011: "end", 63275: "end",
+}
+
 
 ##################################
 ## sheet parameter
 ##################################
 
-# トグルボタン
-class Button:
-    def __init__(self, center_x, center_y, width, height, text="", margin_gain=1.0):
-        self.cx = center_x
-        self.cy = center_y
-        self.minx = (int)(center_x - width / 2 + 0.5)
-        self.maxx = (int)(center_x + width / 2 + 0.5)
-        self.miny = (int)(center_y - height / 2 + 0.5)
-        self.maxy = (int)(center_y + height / 2 + 0.5)
-        self.state = False
-        self.text = text
-        # ボタン中心からどれだけ離れた範囲をクリック領域とみなすか
-        self.margin_gain = margin_gain
-        self.marginx = (int)(width / 2 * self.margin_gain + 0.5) 
-        self.marginy = (int)(height / 2 * self.margin_gain + 0.5)
-
-    def State(self):
-        return self.state
-    
-    def SetState(self, state):
-        self.state = state
-
-    # 戻り値：ステータス変更！
-    def UpdateState(self, x, y):
-        if not self.IsClick(x, y):
-            return False 
-        self.state = not self.state
-        return True
-    
-    def IsClick(self, x, y):
-        if x < self.cx - self.marginx or x > self.cx + self.marginx or y < self.cy - self.marginy or y > self.cy + self.marginy:
-            return False
-        else:
-            return True
-
-    def Render(self, target_img, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color = (0, 0, 0)):
-        color = on_color if self.state else off_color
-        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), color, thickness=-1)
-        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), border_color)
-        if self.text == "":
-            return
-        (w, h), baseline = cv2.getTextSize(self.text, cv2.FONT_HERSHEY_SIMPLEX, 1, 1)
-        x1 = (int)(self.cx - w / 2 + 0.5)
-        y1 = (int)(self.cy + h / 5 + 0.5)
-        cv2.putText(target_img, self.text, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2)
-
-    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
-        cv2.rectangle(target_img, (self.cx - self.marginx, self.cy - self.marginy), 
-                    (self.cx + self.marginx, self.cy + self.marginy), color, thickness=-1)
-
-
-# グループボタン、どれか一個しかONにならない
-class RadioButton:
-    # buttons : class Button
-    def __init__(self, buttons):
-        self.num = len(buttons)
-        self.buttons = [b for b in buttons]
-
-    def SetAllFalse(self):
-        for b in self.buttons:
-            b.SetState(False)
-            
-    def UpdateState(self, x, y):
-        for b in self.buttons:
-            # ボタンのステートが変われば
-            if b.UpdateState(x, y):
-                now_state = b.State()
-                self.SetAllFalse()
-                b.SetState(now_state)
-
-    # -1 : All False, 0 ~ num-1 : buttons[xx] is True
-    def State(self):
-        ret_val = None
-        for i, b in enumerate(self.buttons):
-            if b.State():
-                ret_val = i
-        return ret_val
-
-    def Render(self, target_img, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color=(0, 0, 0)):
-        for b in self.buttons:
-            b.Render(target_img, on_color, off_color, border_color, text_color)
-
-    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
-        for b in self.buttons:
-            b.RenderMarginArea(target_img, color)
-
-
-# フォーム
-class Form:
-    def __init__(self, back_img, window_name, trial_num, size=1.0):
-        f = lambda a:(int)(a * size + 0.5)
-
-        if not os.path.isfile(conf_filename):
-            print(f"{conf_filename}がありません")
+# フォームのテンプレート
+# form_conf.csvの読み込み、シートのリサイズ、ボタンの構築はセッションで一度だけ行う
+# headless=Trueのときはウィンドウを作らず、オフスクリーンのバッファにだけ描画する
+# viewport : ウィンドウの高さ[px]（gainを掛けたあと）。Noneならシート全体を表示する
+# back_img : Noneならsheetをgainごとのキャッシュ（.npy）からmmapで開く（デコードもリサイズもしない）
+# cache_dir : そのキャッシュを置くディレクトリ（Noneならresources/.cache/）
+# fmt : form_conf.csvの書式（"form" または comp_form.py の "comp"）
+# question_num : 先頭から何問を使うか（Noneなら全部）
+# trial_label : 試行番号の書き方（"Trial : {}" など）
+# window_pos : ウィンドウを置く位置
+class FormTemplate:
+    def __init__(self, back_img, window_name, size=1.0, conf=None, headless=False, sheet=None, viewport=None, cache_dir=None,
+                 fmt="form", question_num=None, trial_label="{}", window_pos=(100, 100)):
+        if conf is None:
+            conf = conf_filename
+        if sheet is None:
+            sheet = sheet_filename
+        # gainを掛けたレイアウト（検証済み、ディスクにキャッシュされる）
+        try:
+            layout = LoadLayout(conf, sheet, size, fmt)
+        except ValueError as e:
+            print(e)
             sys.exit()
-        with open(conf_filename, "r") as z:
-            reader = csv.reader(z)
-            dummy = [row for row in reader]
-            imgw = (int)(dummy[0][0])
-            imgh = (int)(dummy[0][1])
-            t = {"l":(int)(dummy[1][0]), "t":(int)(dummy[1][1]), "r":(int)(dummy[1][2]), "b":(int)(dummy[1][3])}
-            p = {"cx":(int)(dummy[2][0]), "cy":(int)(dummy[2][1]), "w":(int)(dummy[2][2]), "h":(int)(dummy[2][3])}
-            n = {"cx":(int)(dummy[3][0]), "cy":(int)(dummy[3][1]), "w":(int)(dummy[3][2]), "h":(int)(dummy[3][3])}
-            g = [{"cx1":(int)(row[0]), "cx2":(int)(row[1]), "cy":(int)(row[2]), "w":(int)(row[3]), "h":(int)(row[4]), "n":(int)(row[5])} for row in dummy[4:]]
-
-        self.form_width = f(imgw)
-        self.form_height = f(imgh)
-
-        self.img = copy.deepcopy(back_img)
-        self.img = cv2.resize(self.img, (self.form_width, self.form_height))
-        self.window_name = window_name
-        cv2.namedWindow(self.window_name)
-        cv2.moveWindow(self.window_name, 100, 100)
+        if question_num is not None and len(layout.rows) < question_num:
+            print(f"{conf}に質問が{question_num}問ありません")
+            sys.exit()
+        rows = layout.rows if question_num is None else layout.rows[:question_num]
 
-        # 画面に条件数を書く
-        # 条件の枠を消す
-        cv2.rectangle(self.img, (f(t['l']), f(t['t'])), (f(t['r']) + 2, f(t['b']) + 2), (255, 255, 255), -1)
-        # 数字を描画
-        fsize = f(t['b'] - t['t']) / 24
-        (w, h), base = cv2.getTextSize(str(trial_num), cv2.FONT_HERSHEY_SIMPLEX, fsize, 2)
-        cv2.putText(self.img, str(trial_num), (f(t['l']), f(t['t']) + h), cv2.FONT_HERSHEY_SIMPLEX, fsize, (0, 0, 0), 2)
+        self.form_width = layout.width
+        self.form_height = layout.height
+        self.window_name = window_name
+        self.window_pos = window_pos
+        self.headless = headless
+        # 表示する高さと、ホイール1目盛りでスクロールする量
+        self.view_height = min(viewport, self.form_height) if viewport else self.form_height
+        self.scroll_step = max(self.view_height // 8, 1)
+
+        if back_img is None:
+            # コピーオンライトのmmapなので、下で書き込んだページだけがメモリにコピーされる
+            try:
+                self.img = LoadSheet(sheet, self.form_width, self.form_height, directory=cache_dir)
+            except (OSError, ValueError) as e:
+                print(e)
+                sys.exit()
+        else:
+            # cv2.resizeは新しい画像を返すのでdeepcopyは不要
+            self.img = cv2.resize(back_img, (self.form_width, self.form_height))
+
+        # 条件の枠を消す（全試行で共通なのでここで一度だけ行う）
+        l, t, r, b, text_x, text_y, trial_height = layout.trial
+        cv2.rectangle(self.img, (l, t), (r, b), (255, 255, 255), -1)
+        self.trial_pos = (text_x, text_y)
+        self.trial_label = trial_label
+        if fmt == "comp":
+            # comp_form.pyの書式では枠の縦の中心を文字のベースラインにする
+            self.trial_fsize = 1.5
+            self.trial_thickness = 3
+            self.trial_baseline = True
+        else:
+            self.trial_fsize = trial_height / 24
+            self.trial_thickness = 2
+            self.trial_baseline = False
 
         # Prevボタン
-        self.prev_button = Button(f(p['cx']), f(p['cy']), f(p['w']), f(p['h']), "prev")
+        self.prev_button = Button(*layout.prev, "prev")
         # Nextボタン
-        self.next_button = Button(f(n['cx']), f(n['cy']), f(n['w']), f(n['h']), "next")
+        self.next_button = Button(*layout.next, "next")
 
         self.all_questions = []
-        idx = 0
-        for idx in range(len(g)):
-            # Question idx+1
-            buttons_num = g[idx]["n"]   # ボタンの数
-            buttons_width = f(g[idx]["w"])
-            buttons_height = f(g[idx]["h"])    
-            q_yc = f(g[idx]["cy"])          
-            q_xmin = f(g[idx]["cx1"])
-            q_xmax = f(g[idx]["cx2"]) 
+        for q_xmin, q_xmax, q_yc, buttons_width, buttons_height, buttons_num in rows.tolist():
             q_xcs = [int(q_xmin + i * (q_xmax - q_xmin) / (buttons_num - 1) + 0.5) for i in range(buttons_num)]
             buttons = []
             for i in range(buttons_num):
                 buttons.append(Button(q_xcs[i], q_yc, buttons_width, buttons_height, margin_gain=2.4))
             self.all_questions.append(RadioButton(buttons))
 
-    def Update(self, x, y):
-        can_push_next = True
+        # 各質問の選択肢数と、zero mean化するときのバイアス
+        self.option_nums = np.array([q.num for q in self.all_questions], dtype=np.int16)
+        self.biases = ((self.option_nums - 1) / 2 + 0.5).astype(np.int16)
+
+        # クリック判定用のインデックス
+        # セルの大きさは回答ボタンのクリック領域に合わせる
+        cell_size = max([max(2 * b.marginx, 2 * b.marginy) for q in self.all_questions for b in q.buttons] + [1])
+        self.click_index = ClickIndex(cell_size)
+        for q_idx, question in enumerate(self.all_questions):
+            for b_idx, b in enumerate(question.buttons):
+                self.click_index.Add(("question", q_idx, b_idx), b)
+        self.click_index.Add(("prev", -1, -1), self.prev_button)
+        self.click_index.Add(("next", -1, -1), self.next_button)
+
+        # 静的なレイヤー：全ボタンのOFF状態、prevボタン、押せない状態のnextボタンを背景に焼き込む
         for question in self.all_questions:
-            question.UpdateState(x, y)
-            if question.State() == None:
-                can_push_next = False
-        self.prev_button.UpdateState(x, y)
-        if can_push_next:
-            self.next_button.UpdateState(x, y)
-
-    def RenderAll(self, x, y):
-        tmp = copy.deepcopy(self.img)
-        can_push_next = True
+            question.Render(self.img)
+        self.prev_button.Render(self.img)
+        self.next_button.Render(self.img, text_color=(230, 230, 230))
+
+        # 状態によって変わるところはスプライトにしておき、背景に貼るだけにする
+        # ONのボタンは大きさごとに1枚
+        self.on_sprites = {}
         for question in self.all_questions:
-            question.Render(tmp)
-            if question.State() == None:
-                can_push_next = False
-        self.prev_button.Render(tmp)
-        text_color = (0, 0, 0) if can_push_next else (230, 230, 230) 
-        self.next_button.Render(tmp, text_color=text_color)
-        # カーソルの描画
-        cv2.circle(tmp, (x, y), 5, (0, 255, 255), thickness=-1)
-        cv2.imshow(self.window_name, tmp)
-        return cv2.waitKey(3)
+            for b in question.buttons:
+                l, t, w, h = b.Region()
+                if (w, h) not in self.on_sprites:
+                    sprite = np.empty((h, w, 3), dtype=np.uint8)
+                    cv2.rectangle(sprite, (0, 0), (w - 1, h - 1), (0, 0, 255), thickness=-1)
+                    cv2.rectangle(sprite, (0, 0), (w - 1, h - 1), (0, 0, 0))
+                    self.on_sprites[(w, h)] = sprite
+        # 押せる状態のnextボタン
+        tmp = self.img.copy()
+        self.next_button.Render(tmp)
+        l, t, w, h = self.next_button.Region()
+        self.next_on_sprite = tmp[max(t, 0):t + h, max(l, 0):l + w].copy()
+
+        # 試行間に出す白い画面
+        self.blank_img = np.full_like(self.img, 255)
+
+        # 試行ごとのフレームのバッファ。シート全体のコピーは試行ごとには作らず、
+        # 表示中の試行と先読みしている次の試行とで、偶数と奇数の試行の2枚を使い回す
+        self.frames = [None, None]
+
+    # 試行trial_numのフレームのバッファ
+    def AcquireFrame(self, trial_num):
+        k = trial_num % 2
+        if self.frames[k] is None:
+            self.frames[k] = FrameBuffer(self.img)
+        return self.frames[k]
+
+    # セッションを通して使うウィンドウを開く（試行ごとには作り直さない）
+    def OpenWindow(self, mouse_event):
+        if self.headless:
+            return
+        cv2.namedWindow(self.window_name)
+        cv2.moveWindow(self.window_name, *self.window_pos)
+        cv2.setMouseCallback(self.window_name, mouse_event)
+
+
+# フレームのバッファ
+# 背景（テンプレートの画像）から描き変えた領域を覚えておき、次の試行で使うときはその領域だけを背景に戻す
+class FrameBuffer:
+    def __init__(self, background):
+        self.background = background
+        self.img = background.copy()
+        self.regions = set()   # 描き変えた (left, top, width, height)
+        self.cursor = None     # カーソルを描いている領域（動くたびに変わるのでregionsとは別に持つ）
+
+    def Mark(self, left, top, width, height):
+        self.regions.add((left, top, width, height))
+
+    def Reset(self):
+        if self.cursor is not None:
+            self.regions.add(self.cursor)
+        for region in self.regions:
+            RestoreRegion(self.img, self.background, *region)
+        self.regions.clear()
+        self.cursor = None
+
+
+# フォーム
+# 試行ごとに試行番号の描画と回答状態のリセットだけを行う
+# 背景はテンプレートの画像をそのまま使い（コピーしない）、試行番号はフレームのバッファにだけ書く
+# ウィンドウはテンプレートのもの（FormTemplate.OpenWindow）を使うので、バックグラウンドのスレッドでも作れる
+# render=Falseなら画像を持たず、クリック判定と回答状態だけを扱う（Webサーバー用）
+class Form:
+    def __init__(self, template, trial_num, render=True):
+        self.template = template
+        self.trial_num = trial_num
+        self.form_width = template.form_width
+        self.form_height = template.form_height
+        self.window_name = template.window_name
+        self.headless = template.headless
+
+        # 画面に書く条件数と、その領域（フレームを作るときに書く）
+        self.img = None
+        if render:
+            self.img = template.img
+            label = template.trial_label.format(trial_num)
+            fsize = template.trial_fsize
+            thickness = template.trial_thickness
+            (w, h), base = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, fsize, thickness)
+            l, t = template.trial_pos
+            origin = (l, t) if template.trial_baseline else (l, t + h)
+            self.trial_text = (label, origin, fsize, thickness)
+            m = thickness + 2
+            self.trial_region = (origin[0] - m, origin[1] - h - m, w + 2 * m, h + base + 2 * m)
+        self.buffer = None       # フレームのバッファ（FormTemplate.AcquireFrame）
+
+        # ボタンの形状はテンプレートのものを使い回し、状態はこのフォームが持つ
+        self.prev_button = template.prev_button
+        self.next_button = template.next_button
+        self.all_questions = template.all_questions
+        self.answers = np.full(len(self.all_questions), -1, dtype=np.int16)   # 各質問で選択中のボタン番号（-1は未回答）
+        self.prev_state = False
+        self.next_state = False
+
+        # イベント駆動描画用
+        self.frame = None        # ボタンまで描画済みのフレーム（カーソルなし）
+        self.dirty = True        # Trueなら次のRenderでフレームを作り直す
+        self.changed = []        # 前回のRender以降に変わった (質問番号, 変更前のボタン番号)
+        self.next_shown = False  # nextボタンを押せる状態で描画しているか
+        self.cursor = None       # (x, y, left, top, カーソル下のパッチ)
+        self.scroll_y = 0        # ウィンドウの上端のシート上のy座標
+
+        # 反応時間の計測用（time.perf_counter_nsの値、0は未回答）
+        # shown_nsは最初のフレームを表示したときに取り直す
+        self.shown = False
+        self.shown_ns = time.perf_counter_ns()
+        self.first_ns = np.zeros(len(self.all_questions), dtype=np.int64)   # 質問ごとに最初に回答した時刻
+        self.last_ns = np.zeros(len(self.all_questions), dtype=np.int64)    # 質問ごとに最後に回答を変えた時刻
+        self.next_ns = 0                                                     # nextを押した時刻
+
+    # t_ns : クリックした時刻（マウスイベントの中で取ったtime.perf_counter_ns）。省略すると今の時刻
+    def Update(self, x, y, t_ns=None):
+        target = self.template.click_index.Query(x, y)
+        if target is None:
+            return
+        if t_ns is None:
+            t_ns = time.perf_counter_ns()
+        kind, q_idx, b_idx = target
+        if kind == "question":
+            # 同じボタンならOFF、違うボタンならそのボタンだけON
+            old = (int)(self.answers[q_idx])
+            self.answers[q_idx] = -1 if old == b_idx else b_idx
+            self.changed.append((q_idx, old))
+            if self.first_ns[q_idx] == 0:
+                self.first_ns[q_idx] = t_ns
+            self.last_ns[q_idx] = t_ns
+        elif kind == "prev":
+            self.prev_state = not self.prev_state
+        elif kind == "next" and self.CanPushNext():
+            self.next_state = not self.next_state
+            self.next_ns = t_ns
+
+    def CanPushNext(self):
+        return bool((self.answers >= 0).all())
+
+    # 回答状態のスナップショット（prevで離れた試行にまた来たときに復元する）
+    # 1行目は回答、2,3行目は質問ごとの最初の回答と最後の変更の、試行を表示してからの時間[ns]（0は未回答）
+    def Snapshot(self):
+        onset = lambda ns: np.where(ns != 0, ns - self.shown_ns, 0)
+        return np.stack([self.answers.astype(np.int64), onset(self.first_ns), onset(self.last_ns)])
+
+    # 反応時間は、この試行を表示した時刻からスナップショットのときと同じだけ経った時刻にする
+    def Restore(self, snapshot):
+        self.answers[:] = snapshot[0]
+        self.first_ns = np.where(snapshot[1] != 0, snapshot[1] + self.shown_ns, 0)
+        self.last_ns = np.where(snapshot[2] != 0, snapshot[2] + self.shown_ns, 0)
+        self.dirty = True
+        self.changed = []
+
+    def RenderWidgets(self, target_img):
+        for question, selected in zip(self.all_questions, self.answers.tolist()):
+            question.Render(target_img, selected)
+        self.prev_button.Render(target_img)
+        text_color = (0, 0, 0) if self.CanPushNext() else (230, 230, 230) 
+        self.next_button.Render(target_img, text_color=text_color)
+
+    # イベント駆動の描画
+    # 背景（OFFのボタンまで焼き込み済み）に、変わったボタンのスプライトだけを貼り直す
+    # カーソルが動いただけのときはカーソル下の小さな領域だけを書き戻す
+    def Render(self, x, y, wait=idle_wait_ms):
+        self.Redraw(x, y)
+        # 何も起きなければwaitKeyで入力を待つ（マウスイベントはこの間に処理される）
+        return self.WaitKey(wait)
+
+    # 必要なときだけフレームを描き直して表示する。描き直したらTrueを返す
+    def Redraw(self, x, y):
+        moved = self.cursor is None or self.cursor[0] != x or self.cursor[1] != y
+        if self.dirty or len(self.changed) > 0 or moved:
+            self.RestoreCursor()
+            self.PrepareFrame()
+            self.DrawCursor(x, y)
+            self.Show(self.frame)
+            if not self.shown:
+                self.shown = True
+                # 復元した反応時間も表示した時刻からの時間のままにする
+                shown_ns = time.perf_counter_ns()
+                self.first_ns[self.first_ns != 0] += shown_ns - self.shown_ns
+                self.last_ns[self.last_ns != 0] += shown_ns - self.shown_ns
+                self.shown_ns = shown_ns
+            return True
+        return False
+
+    # カーソル以外のフレームを今の回答状態に合わせる
+    # 表示する前にバックグラウンドで呼んでおけば、最初のRedrawはカーソルを描いて表示するだけになる
+    def PrepareFrame(self):
+        if self.dirty:
+            # 前に同じバッファを使った試行が描いたところだけを背景に戻す（シート全体はコピーしない）
+            self.buffer = self.template.AcquireFrame(self.trial_num)
+            self.buffer.Reset()
+            self.frame = self.buffer.img
+            self.cursor = None
+            label, origin, fsize, thickness = self.trial_text
+            cv2.putText(self.frame, label, origin, cv2.FONT_HERSHEY_SIMPLEX, fsize, (0, 0, 0), thickness)
+            self.buffer.Mark(*self.trial_region)
+            self.next_shown = False
+            self.changed = [(q_idx, -1) for q_idx in range(len(self.all_questions))]
+            self.dirty = False
+        for q_idx, old in self.changed:
+            self.RenderAnswer(q_idx, old)
+        self.changed = []
+        can_push_next = self.CanPushNext()
+        if can_push_next != self.next_shown:
+            l, t, w, h = self.next_button.Region()
+            if can_push_next:
+                BlitSprite(self.frame, self.template.next_on_sprite, max(l, 0), max(t, 0))
+                self.buffer.Mark(l, t, w, h)
+            else:
+                RestoreRegion(self.frame, self.img, l, t, w, h)
+            self.next_shown = can_push_next
+
+    # 質問q_idxのボタンを、変更前(old)の分は背景に戻し、今選ばれている分はONのスプライトを貼る
+    def RenderAnswer(self, q_idx, old):
+        buttons = self.all_questions[q_idx].buttons
+        if old >= 0:
+            RestoreRegion(self.frame, self.img, *buttons[old].Region())
+        selected = (int)(self.answers[q_idx])
+        if selected >= 0:
+            l, t, w, h = buttons[selected].Region()
+            BlitSprite(self.frame, self.template.on_sprites[(w, h)], l, t)
+            self.buffer.Mark(l, t, w, h)
+
+    # 見えている範囲だけを表示する（コピーしないスライスなので、コストはウィンドウの大きさで決まる）
+    def Show(self, img):
+        if not self.headless:
+            cv2.imshow(self.window_name, img[self.scroll_y:self.scroll_y + self.template.view_height])
+
+    # ウィンドウの座標をシートの座標にする
+    def ToSheet(self, x, y):
+        return x, y + self.scroll_y
+
+    # 下にdyだけスクロールする（上ならマイナス）
+    def Scroll(self, dy):
+        self.scroll_y = min(max(self.scroll_y + (int)(dy), 0), self.form_height - self.template.view_height)
+
+    # 矢印キーならscroll_step、PageUp/PageDownならview_height、Home/Endなら端までスクロールする
+    # スクロールのキーでなければFalseを返す
+    def ScrollKey(self, key):
+        name = scroll_keys.get(key)
+        if name is None:
+            return False
+        step, page = self.template.scroll_step, self.template.view_height
+        self.Scroll({"up": -step, "down": step, "pageup": -page, "pagedown": page,
+                     "home": -self.form_height, "end": self.form_height}[name])
+        return True
+
+    # 矢印キーなどのコードも受け取れるようにwaitKeyExで待つ
+    def WaitKey(self, wait):
+        if self.headless:
+            return -1
+        return cv2.waitKeyEx(wait)
+
+    def DrawCursor(self, x, y):
+        r = cursor_radius + 1
+        left = min(max(x - r, 0), self.form_width)
+        top = min(max(y - r, 0), self.form_height)
+        right = min(max(x + r + 1, 0), self.form_width)
+        bottom = min(max(y + r + 1, 0), self.form_height)
+        self.cursor = (x, y, left, top, self.frame[top:bottom, left:right].copy())
+        self.buffer.cursor = (left, top, right - left, bottom - top)
+        cv2.circle(self.frame, (x, y), cursor_radius, (0, 255, 255), thickness=-1)
+
+    def RestoreCursor(self):
+        if self.cursor is None:
+            return
+        x, y, left, top, patch = self.cursor
+        self.frame[top:top + patch.shape[0], left:left + patch.shape[1]] = patch
+        self.cursor = None
+        self.buffer.cursor = None
     
     def IsGotoPrevState(self):
-        return self.prev_button.State()
+        return self.prev_state
 
     def IsGotoNextState(self):
-        return self.next_button.State()
+        return self.next_state
+
+    # 回答を配列で返す（is_normalize : 中央を0にする）
+    def GetAnswers(self, is_normalize = True):
+        if not is_normalize:
+            return self.answers.copy()
+        return self.answers - self.template.biases
     
     def GetData(self, is_normalize = True):
-        row = {}
-        for i, question in enumerate(self.all_questions):
-            bias = 0 if not is_normalize else (int)((question.num - 1) / 2 + 0.5)
-            row[f'q{i+1}'] = question.State() - bias
-        return row, len(self.all_questions)
+        values = self.GetAnswers(is_normalize).tolist()
+        row = {f'q{i+1}': v for i, v in enumerate(values)}
+        return row, len(values)
+
+    # 表示してからの反応時間[ms]を、質問ごとの (最初の回答, 最後の変更) とnextの順に返す（未回答は''）
+    # prevで戻ってまた来た試行では、それぞれの回答をした回にその試行を表示してからの時間になる
+    def GetTimes(self):
+        ms = lambda ns: round((ns - self.shown_ns) / 1e6, 3) if ns != 0 else ''
+        times = []
+        for first, last in zip(self.first_ns.tolist(), self.last_ns.tolist()):
+            times += [ms(first), ms(last)]
+        return times + [ms(self.next_ns)]
 
     def SetMouseEvent(self, func):
+        if self.headless:
+            return
         # マウスイベント時に関数mouse_touch_flagの処理を行う
         cv2.setMouseCallback(self.window_name, func)
 
 
-global _x
-global _y
-global _touch_flag
-_x = 500
-_y = 500
-_touch_flag = False
+# マウス入力（コールバックが積み、ループが取り出す）
+_mouse = MouseInput()
+
+# 結果ファイルのヘッダ
+# 反応時間の列は、既存の列の位置が変わらないようにtime_stampの後ろに置く
+def ResultHeader(qnum):
+    header = ['trial'] + [f'q{i+1}' for i in range(qnum)] + ['time_stamp']
+    for i in range(qnum):
+        header += [f'rt_first_q{i+1}', f'rt_last_q{i+1}']
+    return header + ['rt_next']
+
 
 # マウスイベント
 def __mouse_event(event, x, y, flag, params):
-    global _x
-    global _y
-    global _touch_flag
-    _x = x
-    _y = y
-    if event == cv2.EVENT_LBUTTONDOWN:
-        _touch_flag = True
+    _mouse.Push(event, x, y, flag)
 
 
+# (cx, cy)を囲む枠を ret_type="lrtb"なら(left, right, top, bottom)、"cxcywh"なら(cx, cy, w, h)で返す
 def __find_nearest_black_pixel(img, cx, cy, ret_type, margin):
-    top = cy
-    bot = cy
-    left = cx
-    right = cx
-    while img[top,cx, 0] > 250:
-        top -= 1
-    top = top - margin
-    while img[bot, cx, 0] > 250:
-        bot += 1
-    bot = bot + margin
-    while img[cy, left, 0] > 250:
-        left -= 1
-    left = left - margin
-    while img[cy, right, 0] > 250:
-        right += 1
-    right = right + margin
+    left, right, top, bot = FindBoxEdges(img, cx, cy, margin)
     if ret_type == "lrtb":
         return left, right, top, bot
     if ret_type == "cxcywh":
@@ -261,24 +501,7 @@ def __find_nearest_black_pixel(img, cx, cy, ret_type, margin):
         hei = bot - top
         return (int)(left + wid / 2 + 0.5), (int)(top + hei / 2 + 0.5), wid, hei
 
-# (x1,y)から(x2,y)までの横プロファイルで、黒線が何本あるかを導出し、ボタンの数を計算する
-def __calculate_button_num(img, x1, x2, y, margin):
-    x = x1
-    black_line_num = 0
-    while x < x2:
-        # 白画素の場合
-        if img[y, x, 0] > 250:
-            x += 1
-        # 黒画素の場合
-        else:
-            black_line_num += 1
-            x += margin + 1  # margin分だけ先を見る
-    return (int)(black_line_num / 2) + 1   # ボタンの数
-
 def FindFormParameter():
-    global _x
-    global _y
-    global _touch_flag
     img = cv2.imread(sheet_filename)
     width = img.shape[1]
     height = img.shape[0]
@@ -311,17 +534,19 @@ def FindFormParameter():
         cv2.namedWindow(window_name)
         cv2.moveWindow(window_name, 0, 0)
         cv2.setMouseCallback(window_name, __mouse_event)
+        _mouse.Clear()
         while True:
+            click = _mouse.NextClick()
             bar_img = img.copy()
-            cv2.circle(bar_img, (_x, _y), 5, (0, 255, 0), -1)
+            cv2.circle(bar_img, (_mouse.x, _mouse.y), 5, (0, 255, 0), -1)
             cv2.imshow(window_name, bar_img)
-            if _touch_flag:
-                if _x < thx and _y < thy and enable_exit:
+            if click is not None:
+                x, y, t_ns = click
+                if x < thx and y < thy and enable_exit:
                     exit_flag = True
                     break
-                click_infos.append([_x, _y])
-                cv2.circle(img, (_x, _y), 5, (0, 0, 255), -1)
-                _touch_flag = False
+                click_infos.append([x, y])
+                cv2.circle(img, (x, y), 5, (0, 0, 255), -1)
                 break
             cv2.waitKey(5)
         cv2.destroyWindow(window_name)
@@ -360,10 +585,14 @@ def FindFormParameter():
                 box_cx1 = cx
                 continue
             # box1cxからbox2cxまで黒線が何本あるかカウントして、ボタンの数を導出する
-            num = __calculate_button_num(img, box_cx1, cx, cy, margin)
+            num = CountButtons(img, box_cx1, cx, cy, margin)
             button_area.append([box_cx1, cx, cy, wid, hei, num])
 
-    with open(conf_filename, "w", newline='') as f:
+    WriteFormConf(conf_filename, width, height, title_area, prev_area, next_area, button_area)
+
+
+def WriteFormConf(conf, width, height, title_area, prev_area, next_area, button_area):
+    with open(conf, "w", newline='') as f:
         writer = csv.writer(f)
         writer.writerow([width, height])
         writer.writerow(title_area)
@@ -372,53 +601,259 @@ def FindFormParameter():
         writer.writerows(button_area)
 
 
-def Play(subject_num, trial_num, start_num = 1, size=1.0, zero_mean = True):
-    global _x
-    global _y
-    global _touch_flag
+# 黒枠で囲まれた白い領域（枠の内側）を連結成分として一度に検出する
+# 戻り値：各枠の[left, top, right, bottom]（枠線の内側の黒画素の位置にmarginを足したもの）
+def DetectBoxes(img, margin=3):
+    height, width = img.shape[:2]
+    white = (img[:, :, 0] > 250).astype(np.uint8)
+    n, labels, stats, centroids = cv2.connectedComponentsWithStats(white, connectivity=4)
+    x = stats[1:, cv2.CC_STAT_LEFT]
+    y = stats[1:, cv2.CC_STAT_TOP]
+    w = stats[1:, cv2.CC_STAT_WIDTH]
+    h = stats[1:, cv2.CC_STAT_HEIGHT]
+    area = stats[1:, cv2.CC_STAT_AREA]
+    # 画像の端に接しておらず、文字の隙間より大きく、シート全体の枠より小さく、ほぼ長方形のもの
+    min_size = max(10, min(width, height) // 40)
+    is_box = (x > 0) & (y > 0) & (x + w < width) & (y + h < height) \
+        & (w >= min_size) & (h >= min_size) \
+        & (w * h < 0.25 * width * height) & (area >= 0.9 * w * h)
+    x, y, w, h = x[is_box], y[is_box], w[is_box], h[is_box]
+    # 内側の白領域のすぐ外が枠線の黒画素
+    return np.stack([x - 1 - margin, y - 1 - margin, x + w + margin, y + h + margin], axis=1)
+
+
+# 枠の一覧から、試行番号の枠、prev/nextボタン、リッカート尺度の行を割り当てる
+# 同じ高さに同じ大きさの枠が2つ以上並んでいれば質問の行とみなす
+def DetectFormParameter(img, margin=3):
+    boxes = DetectBoxes(img, margin)
+    if len(boxes) == 0:
+        return None
+    left, top, right, bot = boxes.T
+    wid = right - left
+    hei = bot - top
+    cx = (left + wid / 2 + 0.5).astype(int)
+    cy = (top + hei / 2 + 0.5).astype(int)
+
+    # y座標で行にまとめる
+    order = np.argsort(cy, kind="stable")
+    rows = []
+    for i in order.tolist():
+        if len(rows) > 0 and abs(cy[i] - cy[rows[-1][0]]) <= hei[rows[-1][0]] / 2:
+            rows[-1].append(i)
+        else:
+            rows.append([i])
 
+    button_area = []
+    others = []
+    for row in rows:
+        row = sorted(row, key=lambda i: cx[i])
+        w = wid[row]
+        h = hei[row]
+        if len(row) >= 2 and w.max() <= w.min() * 1.15 and h.max() <= h.min() * 1.15:
+            last = row[-1]
+            button_area.append([(int)(cx[row[0]]), (int)(cx[last]), (int)(cy[last]), (int)(wid[last]), (int)(hei[last]), len(row)])
+        else:
+            others.extend(row)
+
+    if len(button_area) == 0 or len(others) < 3:
+        return None
+    # 一番上が試行番号、残りのうち左端がprev、右端がnext
+    others = sorted(others, key=lambda i: (cy[i], cx[i]))
+    t = others[0]
+    title_area = [(int)(left[t]), (int)(top[t]), (int)(right[t]), (int)(bot[t])]
+    rest = sorted(others[1:], key=lambda i: cx[i])
+    p = rest[0]
+    n = rest[-1]
+    prev_area = [(int)(cx[p]), (int)(cy[p]), (int)(wid[p]), (int)(hei[p])]
+    next_area = [(int)(cx[n]), (int)(cy[n]), (int)(wid[n]), (int)(hei[n])]
+    return title_area, prev_area, next_area, button_area
+
+
+# クリックなしでシートのパラメータを設定する
+def AutoFindFormParameter(sheet=None, conf=None):
+    sheet = sheet_filename if sheet is None else sheet
+    conf = conf_filename if conf is None else conf
+    img = cv2.imread(sheet)
+    if img is None:
+        print(f"{sheet}が読み込めません")
+        return None
+    params = DetectFormParameter(img)
+    if params is None:
+        print(f"{sheet}の枠を自動で検出できませんでした。--debugでクリックして設定してください")
+        return None
+    title_area, prev_area, next_area, button_area = params
+    WriteFormConf(conf, img.shape[1], img.shape[0], title_area, prev_area, next_area, button_area)
+    print(f"{conf}を作成しました（質問数：{len(button_area)}、選択肢数：{[row[5] for row in button_area]}）")
+    return params
+
+
+# 1枚分の自動設定（プロセスプールから呼ぶ）
+def CalibrateSheet(sheet, conf):
+    start = time.perf_counter()
+    img = cv2.imread(sheet)
+    params = DetectFormParameter(img) if img is not None else None
+    if params is not None:
+        title_area, prev_area, next_area, button_area = params
+        WriteFormConf(conf, img.shape[1], img.shape[0], title_area, prev_area, next_area, button_area)
+    elapsed = time.perf_counter() - start
+    return {
+        "sheet": os.path.basename(sheet),
+        "conf": os.path.basename(conf) if params is not None else "",
+        "questions": len(params[3]) if params is not None else 0,
+        "options": " ".join(str(row[5]) for row in params[3]) if params is not None else "",
+        "ms": round(elapsed * 1000, 1),
+    }
+
+
+# ディレクトリ内のシート画像をすべてのコアで並列に自動設定する
+# <name>.png ごとに <name>_conf.csv を作り、まとめを calibration_report.csv に書く
+def BatchFindFormParameter(dirname, workers=None):
+    sheets = sorted(p for ext in ("*.png", "*.jpg", "*.jpeg", "*.bmp") for p in glob.glob(os.path.join(dirname, ext)))
+    if len(sheets) == 0:
+        print(f"{dirname}にシート画像がありません")
+        return []
+    confs = [os.path.splitext(p)[0] + "_conf.csv" for p in sheets]
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        reports = list(executor.map(CalibrateSheet, sheets, confs))
+    elapsed = time.perf_counter() - start
+
+    report_filename = os.path.join(dirname, "calibration_report.csv")
+    columns = ["sheet", "conf", "questions", "options", "ms"]
+    with open(report_filename, "w", newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(reports)
+    for r in reports:
+        status = f"質問数：{r['questions']}、選択肢数：{r['options']}" if r["conf"] != "" else "検出失敗"
+        print(f"{r['sheet']} : {status}（{r['ms']}ms）")
+    failed = sum(1 for r in reports if r["conf"] == "")
+    print(f"{len(sheets)}枚中{len(sheets) - failed}枚を設定しました（{elapsed:.2f}s）。まとめ：{report_filename}")
+    return reports
+
+
+# 結果の最後に書かれた試行の次の試行番号（ファイルの末尾だけを読む）
+# 結果ファイルはセッションの終わりにまとめて作るので、途中で落ちたときはログの方を見る
+def ResumeStart(subject_num):
+    filename = result_prename + str(subject_num) + result_etcname
+    if os.path.isfile(LogFilename(filename)):
+        filename = LogFilename(filename)
+    last = LastTrial(filename)
+    return 1 if last is None else last + 1
+
+
+def Play(subject_num, trial_num, start_num = 1, size=1.0, zero_mean = True, flush = "row", instrument = False, iti_ms = default_iti_ms, viewport = None):
     print('参加者：{}人目、試行回数：{}回、{}試行目からスタート'.format(subject_num, trial_num, start_num))
 
     window_name = 'Questionnaire Form'
-    img = cv2.imread(sheet_filename)
+    template = FormTemplate(None, window_name, size, viewport=viewport)
+
+    # 回答は試行ごとにメモリに持ち、ディスクにはログとして追記する
+    # セッションの終わりにログをまとめて、1試行1行の結果ファイルを作る
+    qnum = len(template.all_questions)
+    save_filename = result_prename + str(subject_num) + result_etcname
+    header = ResultHeader(qnum)
+    inst = Instrumentation() if instrument else NullInstrumentation()
+    try:
+        store = AnswerStore(save_filename, header, flush, inst)
+    except ValueError as e:
+        print(e)
+        sys.exit()
+    try:
+        PlayTrials(template, store, trial_num, start_num, zero_mean, inst, iti_ms)
+    finally:
+        store.Close()
+        cv2.destroyAllWindows()
+        if inst.enabled:
+            inst.Save(result_prename + str(subject_num) + "_timing" + result_etcname)
+            inst.PrintSummary()
 
-    t = start_num
 
-    while t <= trial_num:
+# 次の試行のフォームをバックグラウンドで作り、最初のフレームまで用意しておく
+# snapshot : 前に回答した試行ならその回答状態（Form.Snapshot）
+# 構築にかかった時間はここ（ワーカースレッド内）でform_buildに記録する
+def BuildForm(template, t, snapshot, inst):
+    t0 = time.perf_counter_ns()
+    form = Form(template, t)
+    if snapshot is not None:
+        form.Restore(snapshot)
+    form.PrepareFrame()
+    inst.Record("form_build", time.perf_counter_ns() - t0)
+    return form
 
-        form = Form(img, window_name, t, size)
-        form.SetMouseEvent(__mouse_event)
 
-        while not form.IsGotoNextState() and not form.IsGotoPrevState():
-            if _touch_flag:
-                form.Update(_x, _y)
-                _touch_flag = False
-            form.RenderAll(_x, _y)
+# 試行間の白い画面。ブロックせず、ウィンドウのイベントは処理し続ける
+def WaitInterval(template, iti_ms):
+    if template.headless:
+        return
+    window.WaitInterval(template.window_name, template.blank_img[:template.view_height], iti_ms, idle_wait_ms)
 
-        cv2.destroyAllWindows()
 
-        # 前に戻るボタンがONならこの試行の結果を無視して前に戻る
-        if form.IsGotoPrevState():
-            t = (t - 1) if t != 0 else t
-            cv2.waitKey(500)
-            continue
+def PlayTrials(template, store, trial_num, start_num, zero_mean, inst, iti_ms=default_iti_ms):
+    template.OpenWindow(__mouse_event)
+    prefetch = futures.ThreadPoolExecutor(max_workers=1)
+    next_form = prefetch.submit(BuildForm, template, start_num, store.Get(start_num), inst)
 
-        _data, _qnum = form.GetData(zero_mean)
-        dt = datetime.datetime.now()
+    t = start_num
+    try:
+        while t <= trial_num:
+
+            # 用意しておいたフォームに差し替える（違う試行に移るときだけここで作る）
+            # 差し替えで待った時間（先読みが間に合わなかった分も含む）はform_swapに記録する
+            t0 = time.perf_counter_ns()
+            form = next_form.result() if next_form is not None else None
+            if form is None or form.trial_num != t:
+                form = BuildForm(template, t, store.Get(t), inst)
+            inst.Record("form_swap", time.perf_counter_ns() - t0)
+            next_form = prefetch.submit(BuildForm, template, t + 1, store.Get(t + 1), inst) if t < trial_num else None
+            # 前の試行の画面を閉じてからのクリックはこの試行の回答にしない
+            _mouse.Clear()
+
+            click_ns = None
+            while not form.IsGotoNextState() and not form.IsGotoPrevState():
+                # 前のフレームから溜まったクリックをすべて処理する
+                for event, x, y, flags, t_ns in _mouse.Drain():
+                    if event == cv2.EVENT_MOUSEWHEEL:
+                        # 1目盛り(120)でscroll_step。奥に回すと上にスクロールする
+                        delta = cv2.getMouseWheelDelta(flags)
+                        form.Scroll(-(delta * template.scroll_step // 120 or (1 if delta > 0 else -1)))
+                        continue
+                    if event != cv2.EVENT_LBUTTONDOWN:
+                        continue
+                    sx, sy = form.ToSheet(x, y)
+                    form.Update(sx, sy, t_ns)
+                    if click_ns is None:
+                        click_ns = t_ns
+                    # prevかnextが押されたら残りは処理しない
+                    if form.IsGotoNextState() or form.IsGotoPrevState():
+                        break
+                t0 = time.perf_counter_ns()
+                if form.Redraw(*form.ToSheet(_mouse.x, _mouse.y)):
+                    t1 = time.perf_counter_ns()
+                    inst.Record("frame", t1 - t0)
+                    if click_ns is not None:
+                        inst.Record("click_to_repaint", t1 - click_ns)
+                        click_ns = None
+                form.ScrollKey(form.WaitKey(idle_wait_ms))
+
+            # 前に戻るボタンがONなら前の試行に戻る
+            # この試行の回答途中の状態は覚えておき、また進んできたときに復元する
+            if form.IsGotoPrevState():
+                store.Remember(t, form.Snapshot())
+                t = (t - 1) if t > 1 else t
+                WaitInterval(template, iti_ms)
+                continue
 
-        record = [t] + [_data[f'q{i+1}'] for i in range(_qnum)] + [dt]
+            _data, _qnum = form.GetData(zero_mean)
+            dt = datetime.datetime.now()
 
-        save_filename = result_prename + str(subject_num) + result_etcname
-        if not os.path.isfile(save_filename):
-            with open(save_filename, 'a', newline='') as f:
-                writer = csv.writer(f)
-                writer.writerow(['trial'] + [f'q{i+1}' for i in range(_qnum)] + ['time_stamp'])
-        with open(save_filename, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(record)
+            record = [t] + [_data[f'q{i+1}'] for i in range(_qnum)] + [dt] + form.GetTimes()
+            store.Put(t, form.Snapshot(), record)
 
-        cv2.waitKey(500)
-        t += 1        
+            WaitInterval(template, iti_ms)
+            t += 1
+    finally:
+        prefetch.shutdown(wait=True)
 
 
 if __name__ == '__main__':
@@ -428,9 +863,14 @@ if __name__ == '__main__':
     start_num = 1
     size_gain = 1.0
     zero_mean = True
+    flush = "row"
+    instrument = False
+    iti_ms = default_iti_ms
+    resume = False
+    viewport = None
 
     try:
-        opts, args = getopt.getopt(argv, 'h:u:t:s:g:z:d', ['help', 'user=', 'trial=', 'start=', 'gain=', 'zmean=', 'debug'])
+        opts, args = getopt.getopt(argv, 'h:u:t:s:g:z:f:b:iadr', ['help', 'user=', 'trial=', 'start=', 'gain=', 'zmean=', 'flush=', 'iti=', 'viewport=', 'batch=', 'instrument', 'auto', 'debug', 'resume'])
     except getopt.GetoptError:
         print(usage)
         sys.exit()
@@ -442,6 +882,12 @@ if __name__ == '__main__':
             if opt in ('-d', '--debug'):
                 FindFormParameter()
                 sys.exit()
+            if opt in ('-a', '--auto'):
+                AutoFindFormParameter()
+                sys.exit()
+            if opt in ('-b', '--batch'):
+                BatchFindFormParameter(arg)
+                sys.exit()
             elif opt in ('-u', '--user'):
                 subject_num = int(arg)
             elif opt in ('-t', '--trial'):
@@ -453,8 +899,27 @@ if __name__ == '__main__':
                 if start_num <= 0:
                     print(usage)
                     sys.exit()
+            elif opt in ('-r', '--resume'):
+                resume = True
             elif opt in ('-z', '--zmean'):
                 zero_mean = True if int(arg) != 0 else False
+            elif opt in ('-i', '--instrument'):
+                instrument = True
+            elif opt == '--viewport':
+                viewport = int(arg)
+                if viewport <= 0:
+                    print(usage)
+                    sys.exit()
+            elif opt == '--iti':
+                iti_ms = int(arg)
+                if iti_ms < 0:
+                    print(usage)
+                    sys.exit()
+            elif opt in ('-f', '--flush'):
+                flush = arg if arg in ("row", "exit") else int(arg)
+                if flush != "row" and flush != "exit" and flush <= 0:
+                    print(usage)
+                    sys.exit()
         except Exception:
             print('Error parsing argument: %s' % opt)
             print(usage)
@@ -462,4 +927,9 @@ if __name__ == '__main__':
     if subject_num == None or subject_num <= 0:
         print(usage)
         sys.exit()
-    Play(subject_num, trial_num, start_num, size_gain, zero_mean)
\ No newline at end of file
+    if resume:
+        start_num = ResumeStart(subject_num)
+        if trial_num is not None and start_num > trial_num:
+            print('参加者：{}人目は全{}試行を終えています'.format(subject_num, trial_num))
+            sys.exit()
+    Play(subject_num, trial_num, start_num, size_gain, zero_mean, flush, instrument, iti_ms, viewport)
\ No newline at end of file
@@ -0,0 +1,311 @@
+import os
+import re
+import csv
+import sys
+import time
+import getopt
+import glob
+import datetime
+
+import form
+from questionnaire.lazy import LazyModule
+from questionnaire.layout import LoadLayout
+
+# cv2、numpyは使うときに読み込む（--helpなどでは読み込まない）
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+futures = LazyModule("concurrent.futures")
+
+
+usage = '''omr.py usage:
+
+紙に印刷したシート（sheet.png）に記入したもののスキャン画像から回答を読み取り、form.pyと同じ形式の結果ファイルを作る
+スキャン画像のファイル名は <参加者番号>_<試行番号>.png（jpg、bmp、tifも可）とする
+結果は <out>/result<参加者番号>.csv に、回答ごとの確信度は <out>/result<参加者番号>_omr.csv に書く
+
+python omr.py <options>
+        --scans=<dir> / -i <dir> : スキャン画像のディレクトリ（必須）
+        --out=<dir> / -o <dir> : 結果の出力先（default : ./result/omr/）
+        --user=<number> / -u <number> : すべて同じ参加者のスキャンとみなし、ファイル名の最後の数字を試行番号にする
+        --zmean=<0 or 1> / -z <0 or 1> : 7段階尺度を(0)0～6にするか(1)-3～3にするか（default : 1）
+        --threshold=<float> : 塗られたとみなす枠の黒画素の割合（シートの印刷分を除く）の下限（default : 0.15）
+        --workers=<number> / -w <number> : 並列に処理するプロセス数（default : コア数）
+'''
+
+scan_exts = ("*.png", "*.jpg", "*.jpeg", "*.bmp", "*.tif", "*.tiff")
+default_out_dir = form.f_result + "omr/"
+default_threshold = 0.15
+# 確信度がこれより低い回答は目で確認するように表示する
+review_confidence = 0.5
+
+
+# スキャン画像をシートに位置合わせして、リッカート尺度の枠ごとの塗りつぶし率を読む
+# シートの特徴点とレイアウトの枠は作るときに一度だけ計算する（プロセスごとに1つ）
+# inner : 枠線を含めないように、枠の中央のこの割合だけを読む
+class SheetReader:
+    def __init__(self, sheet, conf, threshold=default_threshold, inner=0.6, max_features=4000, min_matches=12):
+        layout = LoadLayout(conf, sheet, 1.0, "form")
+        self.width = layout.width
+        self.height = layout.height
+        self.threshold = threshold
+        self.min_matches = min_matches
+
+        ref = cv2.imread(sheet, cv2.IMREAD_GRAYSCALE)
+        if ref is None:
+            raise ValueError(f"{sheet}を画像として読み込めません")
+        if ref.shape != (self.height, self.width):
+            ref = cv2.resize(ref, (self.width, self.height), interpolation=cv2.INTER_AREA)
+
+        # 全質問の全選択肢の枠 [left, top, right, bottom) と、それが何番目の質問の何番目の選択肢か
+        rects = []
+        q_idx = []
+        o_idx = []
+        for q, (q_xmin, q_xmax, q_yc, w, h, num) in enumerate(layout.rows.tolist()):
+            hw = max((int)(w * inner / 2), 1)
+            hh = max((int)(h * inner / 2), 1)
+            for i in range(num):
+                cx = (int)(q_xmin + i * (q_xmax - q_xmin) / (num - 1) + 0.5)
+                rects.append([cx - hw, q_yc - hh, cx + hw + 1, q_yc + hh + 1])
+                q_idx.append(q)
+                o_idx.append(i)
+        rects = np.array(rects, dtype=np.int64).reshape(-1, 4)
+        rects[:, 0::2] = np.clip(rects[:, 0::2], 0, self.width)
+        rects[:, 1::2] = np.clip(rects[:, 1::2], 0, self.height)
+        self.rects = rects
+        self.q_idx = np.array(q_idx, dtype=np.int64)
+        self.o_idx = np.array(o_idx, dtype=np.int64)
+        self.option_nums = layout.rows[:, 5].astype(np.int64)
+        self.qnum = len(self.option_nums)
+
+        # シートに印刷されている分（枠の中の文字など）は塗りつぶしから差し引く
+        self.baseline = self.BoxFill(ref)
+
+        self.orb = cv2.ORB_create(max_features)
+        self.ref_kp, self.ref_des = self.orb.detectAndCompute(ref, None)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+
+    # 枠ごとの黒画素の割合（積分画像から全部の枠を一度に求める）
+    def BoxFill(self, gray):
+        _, ink = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+        s = cv2.integral(ink, sdepth=cv2.CV_32S)
+        l, t, r, b = self.rects.T
+        sums = s[b, r] - s[t, r] - s[b, l] + s[t, l]
+        area = np.maximum((r - l) * (b - t), 1)
+        return sums / area
+
+    # スキャン画像をシートの座標に射影変換する。戻り値：(変換した画像, RANSACのインライア数)。失敗したらNone
+    def Align(self, gray):
+        # 特徴点の検出はシートと同じくらいの大きさで行う
+        scale = self.width / gray.shape[1]
+        if abs(scale - 1) > 0.01:
+            gray = cv2.resize(gray, (self.width, max((int)(gray.shape[0] * scale + 0.5), 1)), interpolation=cv2.INTER_AREA)
+        kp, des = self.orb.detectAndCompute(gray, None)
+        if des is None or self.ref_des is None or len(kp) < self.min_matches:
+            return None, 0
+        # Loweの比テストで曖昧な対応を捨てる
+        good = [p[0] for p in self.matcher.knnMatch(des, self.ref_des, k=2)
+                if len(p) == 2 and p[0].distance < 0.75 * p[1].distance]
+        if len(good) < self.min_matches:
+            return None, 0
+        src = np.float32([kp[m.queryIdx].pt for m in good])
+        dst = np.float32([self.ref_kp[m.trainIdx].pt for m in good])
+        H, mask = cv2.findHomography(src, dst, cv2.RANSAC, 5.0)
+        if H is None:
+            return None, 0
+        inliers = (int)(mask.sum())
+        if inliers < self.min_matches:
+            return None, inliers
+        warped = cv2.warpPerspective(gray, H, (self.width, self.height), flags=cv2.INTER_LINEAR, borderValue=255)
+        return warped, inliers
+
+    # 回答（選んだ選択肢の番号、塗られていなければ-1）と確信度（0～1）を質問ごとに返す
+    # 確信度は 1番目と2番目に塗られた枠の差 / 1番目。塗られていない質問は回答を読めていないので0
+    def Read(self, gray):
+        fill = np.clip(self.BoxFill(gray) - self.baseline, 0, 1)
+        table = np.full((self.qnum, max((int)(self.option_nums.max()), 2)), 0.0)
+        table[self.q_idx, self.o_idx] = fill
+        order = np.argsort(-table, axis=1)
+        rows = np.arange(self.qnum)
+        top = table[rows, order[:, 0]]
+        second = table[rows, order[:, 1]]
+        marked = top >= self.threshold
+        answers = np.where(marked, order[:, 0], -1)
+        confidence = np.where(marked, (top - second) / np.maximum(top, 1e-9), 0)
+        return answers, np.clip(confidence, 0, 1)
+
+
+# ワーカープロセスごとのSheetReader
+_reader = None
+
+
+def InitWorker(sheet, conf, threshold):
+    global _reader
+    # プロセスで並列にするので、OpenCVの中ではスレッドを使わない
+    cv2.setNumThreads(1)
+    _reader = SheetReader(sheet, conf, threshold)
+
+
+# 1ページ分の読み取り（プロセスプールから呼ぶ）
+def ReadPage(page):
+    start = time.perf_counter()
+    result = {"page": page, "answers": [-1] * _reader.qnum, "confidence": [0.0] * _reader.qnum, "inliers": 0, "error": ""}
+    gray = cv2.imread(page, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        result["error"] = "画像として読み込めません"
+    else:
+        warped, result["inliers"] = _reader.Align(gray)
+        if warped is None:
+            result["error"] = "シートに位置合わせできません"
+        else:
+            answers, confidence = _reader.Read(warped)
+            result["answers"] = answers.tolist()
+            result["confidence"] = np.round(confidence, 3).tolist()
+    result["ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+# ファイル名から (参加者番号, 試行番号) を取り出す。取り出せなければNone
+def PageId(page, subject_num=None):
+    nums = re.findall(r"\d+", os.path.splitext(os.path.basename(page))[0])
+    if subject_num is not None:
+        return (subject_num, (int)(nums[-1])) if len(nums) >= 1 else None
+    return ((int)(nums[-2]), (int)(nums[-1])) if len(nums) >= 2 else None
+
+
+# 参加者ごとに、form.pyと同じ形式の結果ファイルと確信度のファイルを書く
+# 読み取れなかったページは結果ファイルには書かず、確信度のファイルにだけエラーとして書く
+def WriteResults(out_dir, subject_num, pages, qnum, biases, zero_mean):
+    os.makedirs(out_dir, exist_ok=True)
+    result_filename = os.path.join(out_dir, f"result{subject_num}.csv")
+    omr_filename = os.path.join(out_dir, f"result{subject_num}_omr.csv")
+    with open(result_filename, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(form.ResultHeader(qnum))
+        for t, r in sorted(pages.items()):
+            if r["error"] != "":
+                continue
+            values = [a - b if zero_mean else a for a, b in zip(r["answers"], biases)]
+            answers = [v if a >= 0 else '' for v, a in zip(values, r["answers"])]
+            # タイムスタンプはスキャンした時刻、反応時間は紙では測れないので空にする
+            dt = datetime.datetime.fromtimestamp(os.path.getmtime(r["page"]))
+            writer.writerow([t] + answers + [dt] + [''] * (2 * qnum + 1))
+    with open(omr_filename, "w", newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["trial", "page", "inliers", "error"] + [f"conf_q{i+1}" for i in range(qnum)])
+        for t, r in sorted(pages.items()):
+            writer.writerow([t, os.path.basename(r["page"]), r["inliers"], r["error"]] + r["confidence"])
+    return result_filename
+
+
+# ディレクトリ内のスキャン画像をすべてのコアで並列に読み取る
+def ReadScans(dirname, out_dir=default_out_dir, subject_num=None, zero_mean=True, threshold=default_threshold,
+              workers=None, sheet=None, conf=None):
+    sheet = form.sheet_filename if sheet is None else sheet
+    conf = form.conf_filename if conf is None else conf
+    pages = sorted(p for ext in scan_exts for p in glob.glob(os.path.join(dirname, ext)))
+    ids = {}
+    for p in pages:
+        page_id = PageId(p, subject_num)
+        if page_id is None:
+            print(f"{os.path.basename(p)} : ファイル名から参加者番号と試行番号がわからないので飛ばします")
+            continue
+        ids[p] = page_id
+    if len(ids) == 0:
+        print(f"{dirname}に読み取れるスキャン画像がありません")
+        return []
+
+    try:
+        layout = LoadLayout(conf, sheet, 1.0, "form")
+    except ValueError as e:
+        print(e)
+        sys.exit()
+    option_nums = layout.rows[:, 5]
+    biases = ((option_nums - 1) / 2 + 0.5).astype(np.int16).tolist()
+    qnum = len(biases)
+
+    targets = list(ids)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(max_workers=workers, initializer=InitWorker, initargs=(sheet, conf, threshold)) as executor:
+        results = list(executor.map(ReadPage, targets, chunksize=max(1, len(targets) // (4 * workers))))
+    elapsed = time.perf_counter() - start
+
+    # 参加者 -> 試行番号 -> 結果
+    # 同じ試行のスキャンが複数あれば後のファイル名のものを使う（ただし読み取れたものを優先する）
+    subjects = {}
+    for r in results:
+        s, t = ids[r["page"]]
+        old = subjects.setdefault(s, {}).get(t)
+        if old is not None:
+            if r["error"] != "" and old["error"] == "":
+                continue
+            print(f"{os.path.basename(r['page'])} : 参加者{s}の試行{t}が重複しているので、こちらを使います")
+        subjects[s][t] = r
+    for s in sorted(subjects):
+        filename = WriteResults(out_dir, s, subjects[s], qnum, biases, zero_mean)
+        read_num = sum(1 for r in subjects[s].values() if r["error"] == "")
+        print(f"参加者{s} : {read_num}試行 -> {filename}")
+
+    for r in results:
+        name = os.path.basename(r["page"])
+        if r["error"] != "":
+            print(f"{name} : {r['error']}（手で入力してください）")
+            continue
+        # form.pyでは未回答のままnextを押せないので、未回答は必ず目で確認する
+        blank = [f"q{i+1}" for i, a in enumerate(r["answers"]) if a < 0]
+        low = [f"q{i+1}" for i, (a, c) in enumerate(zip(r["answers"], r["confidence"])) if a >= 0 and c < review_confidence]
+        if len(blank) > 0:
+            print(f"{name} : 未回答 {' '.join(blank)}（手で確認してください）")
+        if len(low) > 0:
+            print(f"{name} : 確信度が低い回答 {' '.join(low)}")
+    failed = sum(1 for r in results if r["error"] != "")
+    print(f"{len(results)}ページ中{len(results) - failed}ページを読み取りました"
+          f"（{elapsed:.2f}s、{len(results) / max(elapsed, 1e-9) * 60:.0f}ページ/分）")
+    return results
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    scans_dir = None
+    out_dir = default_out_dir
+    subject_num = None
+    zero_mean = True
+    threshold = default_threshold
+    workers = None
+
+    try:
+        opts, args = getopt.getopt(argv, 'hi:o:u:z:w:', ['help', 'scans=', 'out=', 'user=', 'zmean=', 'threshold=', 'workers='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-i', '--scans'):
+                scans_dir = arg
+            elif opt in ('-o', '--out'):
+                out_dir = arg
+            elif opt in ('-u', '--user'):
+                subject_num = int(arg)
+            elif opt in ('-z', '--zmean'):
+                zero_mean = True if int(arg) != 0 else False
+            elif opt == '--threshold':
+                threshold = float(arg)
+                if not 0 < threshold <= 1:
+                    print(usage)
+                    sys.exit()
+            elif opt in ('-w', '--workers'):
+                workers = int(arg)
+                if workers <= 0:
+                    print(usage)
+                    sys.exit()
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    if scans_dir is None or not os.path.isdir(scans_dir):
+        print(usage)
+        sys.exit()
+    ReadScans(scans_dir, out_dir, subject_num, zero_mean, threshold, workers)
@@ -0,0 +1,11 @@
+# form.py / comp_form.py / web_form.py / analysis.py で共有する部品
+#   widgets       : ボタン、ラジオボタン、マップ、クリック判定、スプライトの描画
+#   layout        : form_conf.csvの読み込み（検証とキャッシュ）
+#   result_writer : 結果ファイルの書き込みと復元
+#   conditions    : 条件ファイルの読み込み
+#   mouse_input   : マウス入力のキュー
+#   trajectory    : マウスの軌跡の記録
+#   instrument    : 計測用のヒストグラム
+#
+# cv2とnumpyは読み込みに時間がかかるので、各モジュールではlazy.LazyModuleを通して
+# 実際に使うときに初めて読み込む（--helpや解析だけなら読み込まない）
@@ -0,0 +1,74 @@
+import csv
+import os
+import shutil
+import locale
+
+from .result_writer import ResultWriter, Recover, TrimPartialLine
+
+
+# セッション中の回答を試行ごとに持つストア
+# メモリ上では 試行番号 -> 回答状態（Form.Snapshot()、回答と反応時間）を持ち、prevで戻ったときにすぐ復元する
+# ディスクにはnextを押すたびに結果の行をログ（<結果ファイル>_log.csv）に追記するだけで、書き直しはしない
+# セッションの終わりにCompact()でログをまとめ、1試行1行（同じ試行は最後の行）の結果ファイルを作る
+class AnswerStore:
+    def __init__(self, result_filename, header, flush="row", instrument=None):
+        self.result_filename = result_filename
+        self.log_filename = LogFilename(result_filename)
+        self.header = header
+        self.answers = {}
+        # ログがなく結果ファイルだけがある（以前の形式の）ときは、結果ファイルの行をログの始まりにする
+        if not os.path.isfile(self.log_filename) and os.path.isfile(result_filename):
+            shutil.copyfile(result_filename, self.log_filename)
+        self.log = ResultWriter(self.log_filename, header, flush, instrument)
+
+    # 試行tの回答状態。なければNone
+    def Get(self, t):
+        answers = self.answers.get(t)
+        return None if answers is None else answers.copy()
+
+    # 回答途中の状態を覚えておく（prevで離れるとき用。ログには書かない）
+    def Remember(self, t, answers):
+        self.answers[t] = answers.copy()
+
+    # nextで確定した試行の回答状態と結果の行
+    def Put(self, t, answers, record):
+        self.answers[t] = answers.copy()
+        self.log.Write(record)
+
+    def Close(self):
+        self.log.Close()
+        Compact(self.log_filename, self.result_filename)
+
+
+def LogFilename(result_filename):
+    root, ext = os.path.splitext(result_filename)
+    return root + "_log" + ext
+
+
+# ログの行を試行番号ごとに最後のものだけ残し、試行番号順に結果ファイルへ書き出す
+# 書き出しは一時ファイルに書いてから置き換えるので、途中で落ちても結果ファイルが壊れることはない
+def Compact(log_filename, result_filename):
+    Recover(log_filename)
+    TrimPartialLine(log_filename)
+    encoding = locale.getpreferredencoding(False)
+    with open(log_filename, 'r', newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return 0
+        rows = {}
+        for row in reader:
+            try:
+                rows[(int)(row[0])] = row
+            except (ValueError, IndexError):
+                continue   # 空行など
+    tmp_filename = result_filename + ".tmp"
+    with open(tmp_filename, 'w', newline='', encoding=encoding) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for t in sorted(rows):
+            writer.writerow(rows[t])
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, result_filename)
+    return len(rows)
@@ -0,0 +1,42 @@
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+# --debug（クリックでシートパラメータを設定する）で使う、シート画像の黒枠の検出
+# 画素値が250以下を黒とみなす
+
+# profile（黒画素ならTrueの1次元配列）の先頭から見て最初の黒画素までの距離（なければ端まで）
+def FirstBlack(profile):
+    k = (int)(np.argmax(profile))
+    if not profile[k]:
+        return len(profile) - 1
+    return k
+
+
+# (x, y)を囲む枠の上下左右の黒画素の位置（marginだけ外側に広げる）
+# (x, y)を通る縦と横のプロファイルを一度に二値化し、上下左右で最初の黒画素を探す
+def FindBoxEdges(img, x, y, margin=0):
+    col = img[:, x, 0] <= 250
+    row = img[y, :, 0] <= 250
+    top = y - FirstBlack(col[y::-1]) - margin
+    bot = y + FirstBlack(col[y:]) + margin
+    left = x - FirstBlack(row[x::-1]) - margin
+    right = x + FirstBlack(row[x:]) + margin
+    return left, right, top, bot
+
+
+# (x1,y)から(x2,y)までの横プロファイルで、黒線が何本あるかを導出し、ボタンの数を計算する
+# 黒画素の連続（ラン）を数え、margin以下の隙間で分かれたランは1本の線とみなす
+def CountButtons(img, x1, x2, y, margin):
+    black = img[y, x1:x2, 0] <= 250
+    if not black.any():
+        return 1
+    # ランの始点と終点
+    starts = np.flatnonzero(black[1:] & ~black[:-1]) + 1
+    if black[0]:
+        starts = np.concatenate(([0], starts))
+    ends = np.flatnonzero(black[:-1] & ~black[1:])
+    gaps = starts[1:] - ends[:len(starts) - 1] - 1
+    black_line_num = 1 + (int)(np.count_nonzero(gaps > margin))
+    return (int)(black_line_num / 2) + 1   # ボタンの数
@@ -0,0 +1,102 @@
+import io
+import csv
+import mmap
+import locale
+
+
+# 条件ファイル（conditions/subject<N>.csv）の読み込み
+# 1行目のヘッダのうちtrial以外の列をすべて要因として扱う
+#
+# ファイルはメモリマップで開き、行の位置（オフセット）は必要になったところまでしか調べない
+# 試行は先頭から順に参照されるので、1試行あたりの参照はほぼO(1)
+# 開くときに試行番号の列だけは全体を確かめる（1~試行数が1回ずつ。順番は問わない）
+# 回答したあとで試行が見つからないことがないように、足りない・重複する試行があればここでValueErrorにする
+class ConditionFile:
+    def __init__(self, filename):
+        self.filename = filename
+        self.encoding = locale.getpreferredencoding(False)
+        self.file = open(filename, 'rb')
+        try:
+            self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.file.close()
+            raise ValueError(f"{filename}が空です")
+
+        end = self.mm.find(b'\n')
+        end = len(self.mm) if end < 0 else end
+        self.header = self.__Parse(0, end)
+        if self.header:
+            self.header[0] = self.header[0].lstrip('\ufeff')
+        if 'trial' not in self.header:
+            self.Close()
+            raise ValueError(f"{filename} : trialの列がありません")
+        self.trial_col = self.header.index('trial')
+        self.factor_names = [h for i, h in enumerate(self.header) if i != self.trial_col]
+
+        self.index = {}             # 試行番号 -> (行の先頭, 行の末尾)
+        self.scan_pos = end + 1     # ここより後ろの行はまだ調べていない
+        try:
+            self.trial_num = self.__CheckTrials()
+        except ValueError:
+            self.Close()
+            raise
+
+    def __Parse(self, start, end):
+        line = self.mm[start:end].decode(self.encoding).rstrip('\r')
+        return [v.strip() for v in next(csv.reader([line]), [])]
+
+    # 試行番号の列を確かめ、試行数（試行番号のある行の数）を返す
+    # ファイル全体をまとめてcsvモジュールに渡すので、数万試行でも数十msで終わる
+    def __CheckTrials(self):
+        text = self.mm[self.scan_pos:].decode(self.encoding)
+        reader = csv.reader(io.StringIO(text))
+        trials = set()
+        for row in reader:
+            if len(row) <= self.trial_col or row[self.trial_col].strip() == '':
+                continue
+            value = row[self.trial_col].strip()
+            try:
+                trial = (int)(value)
+            except ValueError:
+                raise ValueError(f"{self.filename} : {reader.line_num + 1}行目の試行番号 {value} が整数ではありません")
+            if trial in trials:
+                raise ValueError(f"{self.filename} : 試行{trial}が2回あります")
+            trials.add(trial)
+        missing = [t for t in range(1, len(trials) + 1) if t not in trials]
+        if missing:
+            raise ValueError(f"{self.filename} : 試行番号は1~{len(trials)}の連番にしてください（試行{missing[0]}がありません）")
+        return len(trials)
+
+    # 試行数
+    def TrialNum(self):
+        return self.trial_num
+
+    # 試行番号tの要因の値を {要因名: 値} で返す
+    def Get(self, t):
+        span = self.index.get(t)
+        while span is None:
+            if self.scan_pos >= len(self.mm):
+                raise KeyError(f"{self.filename} : 試行{t}がありません")
+            start = self.scan_pos
+            end = self.mm.find(b'\n', start)
+            end = len(self.mm) if end < 0 else end
+            self.scan_pos = end + 1
+            row = self.__Parse(start, end)
+            if len(row) <= self.trial_col or row[self.trial_col] == '':
+                continue
+            trial = (int)(row[self.trial_col])
+            self.index[trial] = (start, end)
+            if trial == t:
+                span = (start, end)
+        row = self.__Parse(*span)
+        return {h: row[i] if i < len(row) else '' for i, h in enumerate(self.header) if i != self.trial_col}
+
+    def Close(self):
+        self.mm.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.Close()
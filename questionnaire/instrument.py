@@ -0,0 +1,103 @@
+import csv
+import math
+
+
+# 計測値をまとめる固定長のヒストグラム
+# 1us ~ 2^30us を対数で1オクターブあたりSUB_BINS個のビンに分ける（相対誤差は約9%）
+SUB_BINS = 8
+OCTAVES = 30
+BIN_NUM = SUB_BINS * OCTAVES + 1
+
+
+class Histogram:
+    __slots__ = ("name", "counts", "count", "total_ns", "max_ns")
+
+    def __init__(self, name):
+        self.name = name
+        self.counts = [0] * BIN_NUM
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def Record(self, ns):
+        us = ns / 1000
+        idx = (int)(math.log2(us + 1) * SUB_BINS)
+        self.counts[idx if idx < BIN_NUM else BIN_NUM - 1] += 1
+        self.count += 1
+        self.total_ns += ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    # ビンの範囲[ms]
+    @staticmethod
+    def BinRange(idx):
+        lower = (2 ** (idx / SUB_BINS) - 1) / 1000
+        upper = (2 ** ((idx + 1) / SUB_BINS) - 1) / 1000
+        return lower, upper
+
+    # p : 0~100。ビンの中央の値[ms]を返す
+    def Percentile(self, p):
+        if self.count == 0:
+            return float("nan")
+        target = self.count * p / 100
+        acc = 0
+        for idx, c in enumerate(self.counts):
+            acc += c
+            if acc >= target and c > 0:
+                lower, upper = Histogram.BinRange(idx)
+                return min((lower + upper) / 2, self.max_ns / 1e6)
+        return self.max_ns / 1e6
+
+    def Summary(self):
+        if self.count == 0:
+            return f"{self.name}: n=0"
+        return (f"{self.name}: n={self.count} p50={self.Percentile(50):.2f}ms "
+                f"p95={self.Percentile(95):.2f}ms p99={self.Percentile(99):.2f}ms max={self.max_ns / 1e6:.2f}ms")
+
+
+# Play()の計測
+#   click_to_repaint : クリックしてから画面に反映されるまで
+#   frame            : 1フレームの描画
+#   form_build       : 試行ごとのFormの構築（先読みのスレッド内）
+#   form_swap        : 次の試行に移るときにFormを差し替えるまで
+#   result_write     : 結果1行の書き込み（ResultWriterのスレッド内）
+class Instrumentation:
+    enabled = True
+    metrics = ("click_to_repaint", "frame", "form_build", "form_swap", "result_write")
+
+    def __init__(self):
+        self.histograms = {name: Histogram(name) for name in self.metrics}
+
+    def Record(self, name, ns):
+        self.histograms[name].Record(ns)
+
+    # ヒストグラムを result/～_timing.csv のようなサイドカーファイルに書き出す
+    def Save(self, filename):
+        with open(filename, "w", newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["metric", "lower_ms", "upper_ms", "count"])
+            for h in self.histograms.values():
+                for idx, c in enumerate(h.counts):
+                    if c == 0:
+                        continue
+                    lower, upper = Histogram.BinRange(idx)
+                    writer.writerow([h.name, f"{lower:.4f}", f"{upper:.4f}", c])
+
+    def PrintSummary(self):
+        for h in self.histograms.values():
+            print(h.Summary())
+
+
+# 計測しないとき用。何もしない
+class NullInstrumentation:
+    enabled = False
+
+    def Record(self, name, ns):
+        pass
+
+    def Save(self, filename):
+        pass
+
+    def PrintSummary(self):
+        pass
+
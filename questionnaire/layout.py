@@ -0,0 +1,140 @@
+import os
+import csv
+import hashlib
+
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+# form_conf.csvを検証してバイナリ形式にコンパイルし、ディスクにキャッシュする
+# キャッシュのキーはform_conf.csvとシート画像の内容のハッシュ、書式、gainなので、
+# どれかが変われば自動で作り直される
+#
+# fmt : "form" -> form.py --debug/--auto の書式
+#                 1行目 : 画像の幅, 高さ
+#                 2行目 : 試行番号の枠 left, top, right, bottom
+#                 3,4行目 : prev, nextボタン cx, cy, w, h
+#                 5行目以降 : 質問 左端cx, 右端cx, cy, w, h, 選択肢数
+#       "comp" -> comp_form.py --debug の書式
+#                 2行目 : 試行番号の枠 left, cy, w, h
+#                 5行目以降 : 質問 左端cx, 右端cx, cy, w, h（選択肢数は7）
+
+cache_dir = "./resources/.cache/"
+
+LAYOUT_MAGIC = 0x464C5954   # "FLYT"
+LAYOUT_VERSION = 1
+COMP_OPTION_NUM = 7
+
+
+# gainを掛けたあとのレイアウト
+# trial : 試行番号の枠を消す矩形 left, top, right, bottom と文字の位置 x, y と枠の高さ
+# prev, next : cx, cy, w, h
+# rows : 質問ごとの 左端cx, 右端cx, cy, w, h, 選択肢数 （int32の配列）
+class Layout:
+    __slots__ = ("width", "height", "trial", "prev", "next", "rows")
+
+    def __init__(self, width, height, trial, prev, next, rows):
+        self.width = width
+        self.height = height
+        self.trial = tuple(trial)
+        self.prev = tuple(prev)
+        self.next = tuple(next)
+        self.rows = np.asarray(rows, dtype=np.int32).reshape(-1, 6)
+
+    def ToArray(self):
+        header = [LAYOUT_MAGIC, LAYOUT_VERSION, self.width, self.height, len(self.rows)]
+        return np.concatenate([np.array(header + list(self.trial) + list(self.prev) + list(self.next), dtype="<i4"),
+                               self.rows.astype("<i4").ravel()])
+
+    @staticmethod
+    def FromArray(a):
+        # ヘッダ5個 + trial 7個 + prev 4個 + next 4個 + 質問ごとに6個
+        if len(a) < 20 or a[0] != LAYOUT_MAGIC or a[1] != LAYOUT_VERSION or len(a) != 20 + 6 * a[4]:
+            raise ValueError("レイアウトのキャッシュが壊れています")
+        v = a[:20].tolist()
+        return Layout(v[2], v[3], v[5:12], v[12:16], v[16:20], a[20:])
+
+
+def LoadLayout(conf, sheet, size=1.0, fmt="form", use_cache=True):
+    if not os.path.isfile(conf):
+        raise ValueError(f"{conf}がありません")
+    with open(conf, "rb") as f:
+        conf_bytes = f.read()
+    h = hashlib.sha1()
+    h.update(f"{LAYOUT_VERSION},{fmt},{size!r}".encode())
+    h.update(conf_bytes)
+    if sheet is not None and os.path.isfile(sheet):
+        with open(sheet, "rb") as f:
+            h.update(f.read())
+    cache_filename = os.path.join(cache_dir, f"layout_{h.hexdigest()}.bin")
+
+    if use_cache and os.path.isfile(cache_filename):
+        try:
+            return Layout.FromArray(np.fromfile(cache_filename, dtype="<i4"))
+        except ValueError:
+            pass
+
+    layout = CompileLayout(conf_bytes.decode(), size, fmt, conf)
+    if use_cache:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_filename = cache_filename + ".tmp"
+        layout.ToArray().tofile(tmp_filename)
+        os.replace(tmp_filename, cache_filename)
+    return layout
+
+
+# form_conf.csvの中身を検証し、gainを掛けたLayoutにする
+def CompileLayout(text, size=1.0, fmt="form", name="form_conf.csv"):
+    f = lambda a:(int)(a * size + 0.5)
+
+    def error(msg):
+        return ValueError(f"{name} : {msg}")
+
+    rows = [row for row in csv.reader(text.splitlines()) if len(row) > 0]
+    if len(rows) < 5:
+        raise error("試行番号、prev、nextと1問以上の質問が必要です")
+    try:
+        values = [[(int)(v) for v in row] for row in rows]
+    except ValueError:
+        raise error("整数でない値があります")
+
+    ncol = 6 if fmt == "form" else 5
+    if len(values[0]) < 2 or any(len(v) < 4 for v in values[1:4]) or any(len(v) < ncol for v in values[4:]):
+        raise error("列の数が足りません")
+    imgw, imgh = values[0][:2]
+    if imgw <= 0 or imgh <= 0:
+        raise error("画像の大きさが不正です")
+
+    def check_box(i, cx, cy, w, h):
+        if w <= 0 or h <= 0 or not (0 <= cx <= imgw and 0 <= cy <= imgh):
+            raise error(f"{i + 1}行目の枠が画像の外にあるか大きさが不正です")
+
+    if fmt == "form":
+        l, t, r, b = values[1][:4]
+        if not (0 <= l < r <= imgw and 0 <= t < b <= imgh):
+            raise error("2行目の試行番号の枠が不正です")
+        trial = [f(l), f(t), f(r) + 2, f(b) + 2, f(l), f(t), f(b - t)]
+    elif fmt == "comp":
+        x, y, w, h = values[1][:4]
+        check_box(1, x + w / 2, y, w, h)
+        trial = [f(x) - 2, f(y - h / 2) - 2, f(x + w) + 2, f(y + h / 2) + 2, f(x), f(y), f(h)]
+    else:
+        raise error(f"不明な書式です : {fmt}")
+
+    for i in (2, 3):
+        check_box(i, *values[i][:4])
+    prev = [f(v) for v in values[2][:4]]
+    next = [f(v) for v in values[3][:4]]
+
+    questions = []
+    for i, row in enumerate(values[4:], start=4):
+        cx1, cx2, cy, w, h = row[:5]
+        n = row[5] if fmt == "form" else COMP_OPTION_NUM
+        check_box(i, cx1, cy, w, h)
+        check_box(i, cx2, cy, w, h)
+        if n < 2 or cx1 >= cx2:
+            raise error(f"{i + 1}行目の質問の選択肢が不正です")
+        questions.append([f(cx1), f(cx2), f(cy), f(w), f(h), n])
+
+    return Layout(f(imgw), f(imgh), trial, prev, next, questions)
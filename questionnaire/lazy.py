@@ -0,0 +1,17 @@
+import importlib
+
+
+# 最初に属性を参照したときにimportするモジュールの代理
+#   cv2 = LazyModule("cv2") としておけば、cv2.imread() を呼ぶまでcv2は読み込まれない
+# 読み込んだあとはモジュールの属性をこのオブジェクトにコピーするので、以降の参照は普通の属性アクセスと同じ速さ
+class LazyModule:
+    def __init__(self, name):
+        self.__dict__["_lazy_name"] = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self._lazy_name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return f"<LazyModule {self._lazy_name}>"
@@ -0,0 +1,41 @@
+import collections
+import time
+
+from .lazy import LazyModule
+
+cv2 = LazyModule("cv2")
+
+
+# マウス入力のキュー
+# コールバックは (イベント, x, y, flags, 時刻[ns]) を積むだけで、描画ループが1フレームごとにまとめて取り出す
+# 1フレームの間に何回クリックされても取りこぼさない（dequeのappendとpopleftはスレッドセーフなので、
+# コールバックとループの間で状態を取り合うこともない）
+# maxlenを超えたときは古いものから捨てるが、1000Hzのマウスでも1分以上の余裕がある
+class MouseInput:
+    def __init__(self, maxlen=1 << 16, x=500, y=500):
+        self.events = collections.deque(maxlen=maxlen)
+        # 最後に取り出したイベントのカーソル位置
+        self.x = x
+        self.y = y
+
+    # マウスのコールバックから呼ぶ（flagsはホイールの回転量などを含むOpenCVのflags）
+    def Push(self, event, x, y, flags=0):
+        self.events.append((event, x, y, flags, time.perf_counter_ns()))
+
+    # 溜まっているイベントを古い順に取り出す。途中でやめた分はキューに残る
+    def Drain(self):
+        while self.events:
+            e = self.events.popleft()
+            self.x = e[1]
+            self.y = e[2]
+            yield e
+
+    # 次のクリック (x, y, 時刻[ns]) を取り出す。クリックがなければNone
+    def NextClick(self):
+        for event, x, y, flags, t_ns in self.Drain():
+            if event == cv2.EVENT_LBUTTONDOWN:
+                return x, y, t_ns
+        return None
+
+    def Clear(self):
+        self.events.clear()
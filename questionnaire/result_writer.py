@@ -0,0 +1,221 @@
+import csv
+import io
+import locale
+import os
+import queue
+import threading
+import time
+
+
+# 結果ファイルの書き込み
+# セッション中はファイルを開きっぱなしにし、バックグラウンドのスレッドで書き込む
+# 書き込む行は先にジャーナル（<結果ファイル>.journal）に書いておき、
+# 途中で落ちても次に開いたときにジャーナルから完了した試行を復元する
+#
+# flush : "row"  -> 1行ごとにディスクへ同期
+#         数値N  -> N行ごとにディスクへ同期
+#         "exit" -> 終了時にだけディスクへ同期
+# instrument : instrument.Instrumentation を渡すと1行ごとの書き込み時間を記録する
+class ResultWriter:
+    def __init__(self, filename, header, flush="row", instrument=None):
+        self.filename = filename
+        self.instrument = instrument
+        self.journal_filename = filename + ".journal"
+        self.header = header
+        if flush == "row":
+            self.flush_every = 1
+        elif flush == "exit":
+            self.flush_every = 0
+        else:
+            self.flush_every = (int)(flush)
+            if self.flush_every <= 0:
+                raise ValueError(f"flushの指定が不正です : {flush}")
+
+        # 前回のセッションが途中で落ちていればジャーナルから復元する
+        Recover(self.filename)
+        # 改行で終わっていない書きかけの行があれば切り捨てる（そのまま追記すると次の行とつながってしまう）
+        TrimPartialLine(self.filename)
+        # 以前の形式（列が少ないなど）のファイルなら、今のヘッダの形式に書き直してから追記する
+        MigrateHeader(self.filename, self.header)
+
+        self.file = open(self.filename, 'a', newline='')
+        offset = os.path.getsize(self.filename)
+        self.journal = open(self.journal_filename, 'w', newline='')
+        self.journal.write(f"#offset,{offset}\r\n")
+        self.__Sync(self.journal)
+
+        self.queue = queue.Queue()
+        self.error = None
+        self.pending = 0
+        self.thread = threading.Thread(target=self.__Run, daemon=True)
+        self.thread.start()
+        if offset == 0:
+            self.Write(self.header)
+
+    # 1行分を書き込みキューに積む（UIスレッドはディスクを待たない）
+    def Write(self, record):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(list(record))
+
+    def Close(self):
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+        self.__Sync(self.journal)
+        self.__Sync(self.file)
+        self.file.close()
+        self.journal.close()
+        if self.error is not None:
+            raise self.error
+        # 結果ファイルへの書き込みが確定したのでジャーナルは不要
+        os.remove(self.journal_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.Close()
+
+    def __Run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                start = time.perf_counter_ns()
+                line = FormatRow(record)
+                self.journal.write(line)
+                self.file.write(line)
+                self.pending += 1
+                if self.flush_every > 0 and self.pending >= self.flush_every:
+                    self.__Sync(self.journal)
+                    self.file.flush()
+                    self.pending = 0
+                if self.instrument is not None:
+                    self.instrument.Record("result_write", time.perf_counter_ns() - start)
+            except Exception as e:
+                self.error = e
+
+    @staticmethod
+    def __Sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+
+# csv.writerと同じ形式の1行を返す
+def FormatRow(record):
+    buf = io.StringIO()
+    csv.writer(buf).writerow(record)
+    return buf.getvalue()
+
+
+# ジャーナルが残っていれば結果ファイルをセッション開始時の長さに戻し、ジャーナルの完全な行を書き直す
+def Recover(filename):
+    journal_filename = filename + ".journal"
+    if not os.path.isfile(journal_filename):
+        return False
+    with open(journal_filename, 'r', newline='') as f:
+        lines = f.read().split("\r\n")
+    # 最後の要素は改行で終わっていない書きかけの行（または空文字）なので捨てる
+    lines = lines[:-1]
+    if len(lines) == 0 or not lines[0].startswith("#offset,"):
+        # ジャーナルの先頭すら書けていない場合は結果ファイルに手を付けていない
+        os.remove(journal_filename)
+        return False
+    offset = (int)(lines[0].split(",")[1])
+    with open(filename, 'a+b') as f:
+        f.truncate(offset)
+        f.seek(0, os.SEEK_END)
+        f.write("".join(line + "\r\n" for line in lines[1:]).encode(locale.getpreferredencoding(False)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.remove(journal_filename)
+    print(f"{filename}をジャーナルから復元しました（{len(lines) - 1}行）")
+    return True
+
+
+# 既存のファイルのヘッダがheaderと違えば、列名で対応を取ってheaderの形式に書き直す（ない列は空にする）
+# 以前の版で作った反応時間の列がないファイルなどに、列の多い行をそのまま追記しないようにする
+# headerにない列があるときは書き直すと値が消えるのでValueError
+def MigrateHeader(filename, header):
+    if not os.path.isfile(filename) or os.path.getsize(filename) == 0:
+        return False
+    header = [str(c) for c in header]
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, 'r', newline='', encoding=encoding) as f:
+        reader = csv.reader(f)
+        old = next(reader, None)
+        if old is None or old == header:
+            return False
+        missing = [c for c in old if c not in header]
+        if len(missing) > 0:
+            raise ValueError(f"{filename}の列{missing}が今の結果の形式にないので追記できません。別の参加者番号にするか、ファイルを移動してください")
+        index = [old.index(c) if c in old else -1 for c in header]
+        rows = [[row[i] if 0 <= i < len(row) else '' for i in index] for row in reader if len(row) > 0]
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, 'w', newline='', encoding=encoding) as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, filename)
+    print(f"{filename}を今の結果の形式に書き直しました（{len(old)}列 -> {len(header)}列）")
+    return True
+
+
+# ファイルが改行で終わっていなければ、最後の改行の後ろを切り捨てる
+def TrimPartialLine(filename, block=4096):
+    if not os.path.isfile(filename):
+        return False
+    with open(filename, 'r+b') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            pos = max(pos - block, 0)
+            f.seek(pos)
+            tail = f.read(end - pos)
+            if tail.endswith(b"\n"):
+                return False
+            k = tail.rfind(b"\n")
+            if k >= 0 or pos == 0:
+                f.truncate(pos + k + 1)
+                return True
+            block *= 2
+    return False
+
+
+# 結果ファイルに最後に書き込まれた試行番号（trial_col列目）を返す。1行もなければNone
+# ファイルの末尾からblockバイトだけ読んで最後の完全な行（改行で終わる行）を解析するので、
+# ファイルの長さによらず一定時間で終わる。書きかけの最後の行は読み飛ばす
+def LastTrial(filename, trial_col=0, block=4096):
+    if not os.path.isfile(filename):
+        return None
+    Recover(filename)
+    encoding = locale.getpreferredencoding(False)
+    with open(filename, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            # 見つからなければ読む範囲を広げる（普通は最初のブロックで見つかる）
+            pos = max(pos - block, 0)
+            block *= 2
+            f.seek(pos)
+            tail = f.read(end - pos)
+            # 改行で終わっていない最後の行は書きかけなので捨てる
+            lines = tail[:tail.rfind(b"\n") + 1].splitlines()
+            # 先頭の行は途中から読んでいるかもしれない
+            if pos > 0:
+                lines = lines[1:]
+            for line in reversed(lines):
+                row = next(csv.reader([line.decode(encoding, "replace")]), [])
+                try:
+                    return (int)(row[trial_col])
+                except (ValueError, IndexError):
+                    continue   # ヘッダや空行
+    return None
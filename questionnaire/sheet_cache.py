@@ -0,0 +1,79 @@
+import os
+import glob
+import hashlib
+
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+cv2 = LazyModule("cv2")
+
+
+# シート画像を拡大縮小したBGR画像のキャッシュ
+# 一度作ったらgain（大きさ）ごとに .npy で保存し、次からはmmapで開くだけにする（PNGのデコードもリサイズもしない）
+# キャッシュのキーはシート画像の中身のハッシュと大きさなので、sheet.pngが変われば自動で作り直される
+# ファイル名は sheet_<シートのパスのハッシュ>_<幅>x<高さ>_<中身のハッシュ>.npy
+cache_dir = "./resources/.cache/"
+
+SHEET_CACHE_VERSION = 1
+# 1つのシートについて残しておく大きさ（gain）の数。これより多くなったら使っていないものから消す
+MAX_SIZES_PER_SHEET = 3
+
+
+# sheetをwidth x heightにした画像を返す
+# mode : np.loadのmmap_mode。"c"はコピーオンライトで、書き込んだページだけがメモリにコピーされ、ファイルは変わらない
+# directory : キャッシュを置くディレクトリ（Noneならcache_dir）
+def LoadSheet(sheet, width, height, mode="c", use_cache=True, directory=None):
+    directory = cache_dir if directory is None else directory
+    with open(sheet, "rb") as f:
+        data = f.read()
+    h = hashlib.sha1()
+    h.update(f"{SHEET_CACHE_VERSION},{width},{height}".encode())
+    h.update(data)
+    prefix = "sheet_" + hashlib.sha1(os.path.abspath(sheet).encode()).hexdigest()[:12]
+    cache_filename = os.path.join(directory, f"{prefix}_{width}x{height}_{h.hexdigest()}.npy")
+
+    if use_cache and os.path.isfile(cache_filename):
+        try:
+            img = np.load(cache_filename, mmap_mode=mode)
+            if img.shape == (height, width, 3) and img.dtype == np.uint8:
+                # 最近使ったものとして残るように更新時刻を進める
+                os.utime(cache_filename)
+                return np.asarray(img)
+        except ValueError:
+            pass
+
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f"{sheet}を画像として読み込めません")
+    img = cv2.resize(img, (width, height))
+    if not use_cache:
+        return img
+    os.makedirs(directory, exist_ok=True)
+    tmp_filename = cache_filename + ".tmp.npy"
+    np.save(tmp_filename, img)
+    os.replace(tmp_filename, cache_filename)
+    Evict(directory, prefix, cache_filename)
+    return np.asarray(np.load(cache_filename, mmap_mode=mode))
+
+
+# 同じシートの古いキャッシュを消す
+# 中身が変わる前のもの（同じ大きさで別のハッシュ）はすべて、ほかの大きさは新しい順にMAX_SIZES_PER_SHEETまで残す
+# ファイル名にシートのパスが入っていなかった以前の形式（sheet_<ハッシュ>.npy）はもう読まないので消す
+def Evict(directory, prefix, keep):
+    size = os.path.basename(keep)[len(prefix) + 1:].split("_")[0]
+    entries = sorted(glob.glob(os.path.join(directory, prefix + "_*.npy")), key=os.path.getmtime, reverse=True)
+    stale = [p for p in glob.glob(os.path.join(directory, "sheet_*.npy")) if len(os.path.basename(p)) == len("sheet_.npy") + 40]
+    sizes = {size}
+    for filename in entries:
+        if filename == keep:
+            continue
+        entry_size = os.path.basename(filename)[len(prefix) + 1:].split("_")[0]
+        if entry_size not in sizes and len(sizes) < MAX_SIZES_PER_SHEET:
+            sizes.add(entry_size)
+            continue
+        stale.append(filename)
+    for filename in stale:
+        try:
+            os.remove(filename)
+        except OSError:
+            pass   # ほかのプロセスが開いている（Windows）ときは次の機会に消す
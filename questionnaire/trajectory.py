@@ -0,0 +1,81 @@
+import struct
+import time
+
+from .lazy import LazyModule
+
+np = LazyModule("numpy")
+
+
+# マウスの軌跡の記録
+# マウスイベントごとに (時刻[ns], イベント, x, y) を確保済みのリングバッファに書くだけなので、
+# コールバックでメモリの確保は起きない。試行が終わったらまとめてバイナリでファイルに追記する
+#
+# ファイルの書式（リトルエンディアン）: 試行ごとに
+#   ヘッダ  : TRAJ_MAGIC, 試行番号(uint32), 記録数(uint32), 溢れて捨てた数(uint32), 試行開始時刻[ns](int64)
+#   記録    : TRAJ_FIELDS x 記録数
+# バッファが溢れたときは古いものから捨てる
+TRAJ_MAGIC = b"TRJ1"
+TRAJ_HEADER = struct.Struct("<4sIIIq")
+# 記録の型（np.dtypeに渡す）。numpyを読み込まなくてもimportできるようにリストで持つ
+TRAJ_FIELDS = [("t_ns", "<i8"), ("event", "<i4"), ("x", "<i4"), ("y", "<i4")]
+
+
+class TrajectoryRecorder:
+    def __init__(self, filename, capacity=1 << 18):
+        self.filename = filename
+        self.capacity = capacity
+        self.t_ns = np.zeros(capacity, dtype=np.int64)
+        self.event = np.zeros(capacity, dtype=np.int32)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.count = 0
+        self.start_ns = time.perf_counter_ns()
+
+    # マウスのコールバックから呼ぶ
+    def Record(self, event, x, y):
+        i = self.count % self.capacity
+        self.t_ns[i] = time.perf_counter_ns()
+        self.event[i] = event
+        self.x[i] = x
+        self.y[i] = y
+        self.count += 1
+
+    # 試行の開始時に呼ぶ
+    def Reset(self):
+        self.count = 0
+        self.start_ns = time.perf_counter_ns()
+
+    # 試行の軌跡をファイルに追記し、バッファを空にする
+    def Flush(self, trial):
+        n = min(self.count, self.capacity)
+        dropped = self.count - n
+        # リングバッファを古い順に並べる
+        order = np.arange(self.count - n, self.count) % self.capacity
+        records = np.empty(n, dtype=TRAJ_FIELDS)
+        records["t_ns"] = self.t_ns[order]
+        records["event"] = self.event[order]
+        records["x"] = self.x[order]
+        records["y"] = self.y[order]
+        with open(self.filename, "ab") as f:
+            f.write(TRAJ_HEADER.pack(TRAJ_MAGIC, trial, n, dropped, self.start_ns))
+            f.write(records.tobytes())
+        self.Reset()
+
+
+# 軌跡ファイルを読む
+# 戻り値：[(試行番号, 試行開始時刻[ns], 溢れて捨てた数, 記録の配列), ...]
+def LoadTrajectory(filename):
+    with open(filename, "rb") as f:
+        data = f.read()
+    dtype = np.dtype(TRAJ_FIELDS)
+    trials = []
+    pos = 0
+    while pos + TRAJ_HEADER.size <= len(data):
+        magic, trial, n, dropped, start_ns = TRAJ_HEADER.unpack_from(data, pos)
+        pos += TRAJ_HEADER.size
+        end = pos + n * dtype.itemsize
+        if magic != TRAJ_MAGIC or end > len(data):
+            break   # 書き込み途中で落ちた最後の試行は読まない
+        trials.append((trial, start_ns, dropped, np.frombuffer(data, dtype=dtype, count=n, offset=pos)))
+        pos = end
+    return trials
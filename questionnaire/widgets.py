@@ -0,0 +1,208 @@
+from .lazy import LazyModule
+
+cv2 = LazyModule("cv2")
+
+
+# トグルボタン
+class Button:
+    __slots__ = ("cx", "cy", "minx", "maxx", "miny", "maxy", "state", "text", "margin_gain", "marginx", "marginy")
+
+    def __init__(self, center_x, center_y, width, height, text="", margin_gain=1.0):
+        self.cx = center_x
+        self.cy = center_y
+        self.minx = (int)(center_x - width / 2 + 0.5)
+        self.maxx = (int)(center_x + width / 2 + 0.5)
+        self.miny = (int)(center_y - height / 2 + 0.5)
+        self.maxy = (int)(center_y + height / 2 + 0.5)
+        self.state = False
+        self.text = text
+        # ボタン中心からどれだけ離れた範囲をクリック領域とみなすか
+        self.margin_gain = margin_gain
+        self.marginx = (int)(width / 2 * self.margin_gain + 0.5) 
+        self.marginy = (int)(height / 2 * self.margin_gain + 0.5)
+
+    def State(self):
+        return self.state
+    
+    def SetState(self, state):
+        self.state = state
+
+    # 戻り値：ステータス変更！
+    def UpdateState(self, x, y):
+        if not self.IsClick(x, y):
+            return False 
+        self.state = not self.state
+        return True
+    
+    def IsClick(self, x, y):
+        if x < self.cx - self.marginx or x > self.cx + self.marginx or y < self.cy - self.marginy or y > self.cy + self.marginy:
+            return False
+        else:
+            return True
+
+    def Render(self, target_img, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color = (0, 0, 0)):
+        self.RenderAs(target_img, self.state, on_color, off_color, border_color, text_color)
+
+    # self.stateではなく指定したstateで描画する
+    def RenderAs(self, target_img, state, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color = (0, 0, 0)):
+        color = on_color if state else off_color
+        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), color, thickness=-1)
+        cv2.rectangle(target_img, (self.minx, self.miny), (self.maxx, self.maxy), border_color)
+        if self.text == "":
+            return
+        (w, h), baseline = cv2.getTextSize(self.text, cv2.FONT_HERSHEY_SIMPLEX, 1, 1)
+        x1 = (int)(self.cx - w / 2 + 0.5)
+        y1 = (int)(self.cy + h / 5 + 0.5)
+        cv2.putText(target_img, self.text, (x1, y1), cv2.FONT_HERSHEY_SIMPLEX, 1, text_color, 2)
+
+    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
+        cv2.rectangle(target_img, (self.cx - self.marginx, self.cy - self.marginy), 
+                    (self.cx + self.marginx, self.cy + self.marginy), color, thickness=-1)
+
+    # 描画される範囲 (left, top, width, height)。枠線はmaxx, maxyの画素まで描かれる
+    def Region(self):
+        return self.minx, self.miny, self.maxx - self.minx + 1, self.maxy - self.miny + 1
+
+
+# spriteをdstの(left, top)に貼る（はみ出した部分は切り捨てる）
+def BlitSprite(dst, sprite, left, top):
+    h, w = sprite.shape[:2]
+    l = max(left, 0)
+    t = max(top, 0)
+    r = min(left + w, dst.shape[1])
+    b = min(top + h, dst.shape[0])
+    if l >= r or t >= b:
+        return
+    dst[t:b, l:r] = sprite[t - top:b - top, l - left:r - left]
+
+# srcの矩形領域をdstに書き戻す
+def RestoreRegion(dst, src, left, top, width, height):
+    l = max(left, 0)
+    t = max(top, 0)
+    r = min(left + width, dst.shape[1])
+    b = min(top + height, dst.shape[0])
+    if l >= r or t >= b:
+        return
+    dst[t:b, l:r] = src[t:b, l:r]
+
+
+# グループボタン、どれか一個しかONにならない
+# form.pyでは形状だけを使い、回答状態はFormのanswers配列（選択中のボタン番号、-1は未回答）が持つ
+# comp_form.pyでは各ボタンのstateに回答状態を持つ（SetAllFalse, UpdateState, State）
+class RadioButton:
+    __slots__ = ("num", "buttons")
+
+    # buttons : class Button
+    def __init__(self, buttons):
+        self.num = len(buttons)
+        self.buttons = [b for b in buttons]
+
+    def SetAllFalse(self):
+        for b in self.buttons:
+            b.SetState(False)
+
+    def UpdateState(self, x, y):
+        for b in self.buttons:
+            # ボタンのステートが変われば
+            if b.UpdateState(x, y):
+                now_state = b.State()
+                self.SetAllFalse()
+                b.SetState(now_state)
+
+    # None : All False, 0 ~ num-1 : buttons[xx] is True
+    def State(self):
+        ret_val = None
+        for i, b in enumerate(self.buttons):
+            if b.State():
+                ret_val = i
+        return ret_val
+
+    # selected : ONのボタン番号（-1 : All False、None : 各ボタンのstateのとおり）
+    def Render(self, target_img, selected=None, on_color = (0, 0, 255), off_color = (255, 255, 255), border_color = (0, 0, 0), text_color=(0, 0, 0)):
+        for i, b in enumerate(self.buttons):
+            state = b.State() if selected is None else i == selected
+            b.RenderAs(target_img, state, on_color, off_color, border_color, text_color)
+
+    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
+        for b in self.buttons:
+            b.RenderMarginArea(target_img, color)
+
+
+# クリック判定用の空間インデックス（一様グリッド）
+# 各セルにそのセルと重なるクリック領域の番号を持たせておき、クリック位置のセルだけを調べる
+class ClickIndex:
+    def __init__(self, cell_size=64):
+        self.cell_size = max((int)(cell_size), 1)
+        self.targets = []   # (target, cx, cy, marginx, marginy)
+        self.cells = {}
+
+    def Add(self, target, button):
+        idx = len(self.targets)
+        self.targets.append((target, button.cx, button.cy, button.marginx, button.marginy))
+        c = self.cell_size
+        for gx in range((button.cx - button.marginx) // c, (button.cx + button.marginx) // c + 1):
+            for gy in range((button.cy - button.marginy) // c, (button.cy + button.marginy) // c + 1):
+                self.cells.setdefault((gx, gy), []).append(idx)
+
+    # クリック領域に(x, y)を含むもののうち、ボタン中心に最も近いものを返す。なければNone
+    def Query(self, x, y):
+        best = None
+        best_dist = None
+        for idx in self.cells.get((x // self.cell_size, y // self.cell_size), ()):
+            target, cx, cy, mx, my = self.targets[idx]
+            if x < cx - mx or x > cx + mx or y < cy - my or y > cy + my:
+                continue
+            dist = (x - cx) ** 2 + (y - cy) ** 2
+            if best_dist is None or dist < best_dist:
+                best = target
+                best_dist = dist
+        return best
+
+
+# 二次元マップ
+class Map:
+    def __init__(self, center_x, center_y, width, height, margin_gain=1.0):
+        self.cx = center_x
+        self.cy = center_y
+        self.minx = (int)(center_x - width / 2 + 0.5)
+        self.maxx = (int)(center_x + width / 2 + 0.5)
+        self.miny = (int)(center_y - height / 2 + 0.5)
+        self.maxy = (int)(center_y + height / 2 + 0.5)
+        self.state = False
+        # ボタン中心からどれだけ離れた範囲をクリック領域とみなすか
+        self.margin_gain = margin_gain
+        self.marginx = (int)(width / 2 * self.margin_gain + 0.5) 
+        self.marginy = (int)(height / 2 * self.margin_gain + 0.5)
+        self.posX = None
+        self.posY = None
+    
+    # 戻り値：ステータス変更！
+    def UpdateState(self, x, y):
+        if not self.IsClick(x, y):
+            return False 
+        self.posX = self.maxx if x > self.maxx else self.minx if x < self.minx else x
+        self.posY = self.maxy if y > self.maxy else self.miny if y < self.miny else y
+        return True
+    
+    def IsClick(self, x, y):
+        if x < self.cx - self.marginx or x > self.cx + self.marginx or y < self.cy - self.marginy or y > self.cy + self.marginy:
+            return False
+        else:
+            return True
+
+    def Render(self, target_img, color = (0, 0, 255), point_size = 5):
+        if self.posX == None or self.posY == None:
+            return 
+        cv2.circle(target_img, (self.posX, self.posY), point_size, color, thickness=-1)
+
+    def RenderMarginArea(self, target_img, color = (0, 255, 255)):
+        cv2.rectangle(target_img, (self.cx - self.marginx, self.cy - self.marginy), 
+                    (self.cx + self.marginx, self.cy + self.marginy), color, thickness=-1)
+
+    # -1 ~ 1, -1 ~ 1で返す
+    def State(self):
+        if self.posX == None or self.posY == None:
+            return (None, None)
+        xvalue = -1 + 2 * (self.posX - self.minx) / (self.maxx - self.minx)
+        yvalue = -1 * (-1 + 2 * (self.posY - self.miny) / (self.maxy - self.miny))
+        return (xvalue, yvalue)
@@ -0,0 +1,19 @@
+import time
+
+from .lazy import LazyModule
+
+cv2 = LazyModule("cv2")
+
+
+# 試行間の白い画面。ウィンドウは閉じず、ブロックせずにイベントを処理し続ける
+# poll_ms : waitKeyで待つ1回あたりの時間[ms]
+def WaitInterval(window_name, blank_img, iti_ms, poll_ms=15):
+    if iti_ms <= 0:
+        return
+    cv2.imshow(window_name, blank_img)
+    deadline = time.perf_counter() + iti_ms / 1000
+    while True:
+        remain_ms = (int)((deadline - time.perf_counter()) * 1000)
+        if remain_ms <= 0:
+            break
+        cv2.waitKey(min(remain_ms, poll_ms))
@@ -0,0 +1,327 @@
+import sys
+import json
+import uuid
+import datetime
+import getopt
+import urllib.parse
+
+import form
+from questionnaire.lazy import LazyModule
+from questionnaire.answer_store import AnswerStore
+
+# サーバーを起動するまで読み込まない（--helpを速くする）
+cv2 = LazyModule("cv2")
+asyncio = LazyModule("asyncio")
+
+
+usage = '''web_form.py usage:
+
+ブラウザ（タブレットなど）から回答できるWebサーバーを起動する。1つのプロセスで複数の参加者を同時に扱う
+http://<host>:<port>/?user=<参加者番号> を開くと回答を始める
+
+python web_form.py <options>
+        --trial=<number> / -t <number> : 全試行数
+        --host=<address> : 待ち受けるアドレス (default : 127.0.0.1、LANに公開するなら 0.0.0.0)
+        --port=<number> / -p <number> : ポート番号 (default : 8080)
+        --gain=<float> / -g <float> : フォームのサイズ（default : 1）
+        --zmean=<0 or 1> / -z <0 or 1> : 7段階尺度を(0)0～6にするか(1)-3～3にするか（default : 1）
+        --flush=<row, number or exit> / -f <...> : 結果ファイルをディスクへ同期するタイミング（default : row）
+'''
+
+
+page = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Questionnaire Form</title>
+<meta name="viewport" content="width=device-width">
+<style>body{margin:0}canvas{max-width:100vw;touch-action:manipulation}</style></head>
+<body><canvas id="c"></canvas><script>
+const c = document.getElementById("c"), ctx = c.getContext("2d"), img = new Image();
+let layout = null, state = null;
+async function post(path, params) {
+  const r = await fetch(path + "?" + new URLSearchParams(params), {method: "POST"});
+  return r.json();
+}
+function draw() {
+  ctx.drawImage(img, 0, 0);
+  ctx.fillStyle = "#000";
+  ctx.font = layout.trial_font + "px sans-serif";
+  ctx.fillText(state.done ? "end" : String(state.trial), layout.trial_pos[0], layout.trial_pos[1] + layout.trial_font);
+  ctx.fillStyle = "#f00";
+  state.answers.forEach((a, q) => {
+    if (a < 0) return;
+    const b = layout.questions[q][a];
+    ctx.fillRect(b[0], b[1], b[2] - b[0], b[3] - b[1]);
+    ctx.strokeRect(b[0], b[1], b[2] - b[0], b[3] - b[1]);
+  });
+  if (state.can_next) {
+    const n = layout.next;
+    ctx.fillStyle = "#fff";
+    ctx.fillRect(n[0] + 1, n[1] + 1, n[2] - n[0] - 2, n[3] - n[1] - 2);
+    ctx.fillStyle = "#000";
+    ctx.font = "bold 22px sans-serif";
+    ctx.textAlign = "center";
+    ctx.fillText("next", (n[0] + n[2]) / 2, (n[1] + n[3]) / 2 + 8);
+    ctx.textAlign = "start";
+  }
+}
+c.addEventListener("click", async (e) => {
+  if (state === null || state.done) return;
+  const r = c.getBoundingClientRect();
+  const x = Math.round((e.clientX - r.left) * c.width / r.width);
+  const y = Math.round((e.clientY - r.top) * c.height / r.height);
+  state = await post("/click", {session: state.session, x: x, y: y});
+  draw();
+});
+(async () => {
+  layout = await (await fetch("/layout")).json();
+  c.width = layout.width;
+  c.height = layout.height;
+  state = await post("/session", {user: new URLSearchParams(location.search).get("user")});
+  img.onload = draw;
+  img.src = "/sheet.png";
+})();
+</script></body></html>
+'''
+
+
+# 参加者1人分のセッション。Play()と同じ流れで試行を進め、結果を書き込む
+class Session:
+    def __init__(self, template, subject_num, trial_num, zero_mean, flush):
+        self.id = uuid.uuid4().hex
+        self.template = template
+        self.subject_num = subject_num
+        self.trial_num = trial_num
+        self.zero_mean = zero_mean
+        header = form.ResultHeader(len(template.all_questions))
+        # form.pyの--resumeと同じく、結果ファイル（落ちたときはログ）の最後の試行の次から始める
+        self.t = form.ResumeStart(subject_num)
+        self.done = self.t > trial_num
+        if self.done:
+            # 全試行を終えていれば結果ファイルには触らない（開き直しで回答を上書きしない）
+            self.store = None
+            self.form = form.Form(template, trial_num, render=False)
+        else:
+            self.store = AnswerStore(form.result_prename + str(subject_num) + form.result_etcname, header, flush)
+            self.form = self.NewForm()
+
+    # 戻り値：セッションが終わったらTrue
+    def Click(self, x, y):
+        if self.done:
+            return False
+        self.form.Update(x, y)
+        if self.form.IsGotoPrevState():
+            self.store.Remember(self.t, self.form.Snapshot())
+            self.t = (self.t - 1) if self.t > 1 else self.t
+            self.form = self.NewForm()
+        elif self.form.IsGotoNextState():
+            _data, _qnum = self.form.GetData(self.zero_mean)
+            dt = datetime.datetime.now()
+            record = [self.t] + [_data[f'q{i+1}'] for i in range(_qnum)] + [dt] + self.form.GetTimes()
+            self.store.Put(self.t, self.form.Snapshot(), record)
+            self.t += 1
+            if self.t > self.trial_num:
+                self.done = True
+                return True
+            self.form = self.NewForm()
+        return False
+
+    # 試行self.tのフォーム。前に回答した試行ならその回答を復元する
+    def NewForm(self):
+        f = form.Form(self.template, self.t, render=False)
+        snapshot = self.store.Get(self.t)
+        if snapshot is not None:
+            f.Restore(snapshot)
+        return f
+
+    def State(self):
+        return {
+            "session": self.id,
+            "user": self.subject_num,
+            "trial": self.t,
+            "answers": self.form.answers.tolist(),
+            "can_next": self.form.CanPushNext(),
+            "done": self.done,
+        }
+
+
+class FormServer:
+    def __init__(self, trial_num, size=1.0, zero_mean=True, flush="row"):
+        self.template = form.FormTemplate(None, "web", size, headless=True)
+        self.trial_num = trial_num
+        self.zero_mean = zero_mean
+        self.flush = flush
+        self.sessions = {}       # session id -> Session
+        self.user_sessions = {}  # 参加者番号 -> Session
+        self.pending_sessions = {}  # 参加者番号 -> 作っている途中のSessionのFuture
+        self.closing_sessions = {}  # 参加者番号 -> 終えたセッションのログをまとめている途中のFuture
+
+        # 静的なものは起動時に一度だけ作る
+        # シート画像はOFFのボタンまで焼き込んだテンプレートの背景をそのまま送る
+        ok, png = cv2.imencode(".png", self.template.img)
+        self.sheet_png = png.tobytes()
+        rect = lambda b: [b.minx, b.miny, b.maxx, b.maxy]
+        self.layout_json = json.dumps({
+            "width": self.template.form_width,
+            "height": self.template.form_height,
+            "trial_pos": list(self.template.trial_pos),
+            "trial_font": (int)(self.template.trial_fsize * 22 + 0.5),
+            "questions": [[rect(b) for b in q.buttons] for q in self.template.all_questions],
+            "prev": rect(self.template.prev_button),
+            "next": rect(self.template.next_button),
+        }).encode()
+
+    async def Dispatch(self, method, path, params):
+        if method == "GET" and path == "/":
+            return 200, "text/html; charset=utf-8", page.encode()
+        if method == "GET" and path == "/sheet.png":
+            return 200, "image/png", self.sheet_png
+        if method == "GET" and path == "/layout":
+            return 200, "application/json", self.layout_json
+        if method == "POST" and path == "/session":
+            subject_num = (int)(params["user"])
+            if subject_num <= 0:
+                raise ValueError("user")
+            # 同じ参加者がページを開き直したときは続きから
+            session = self.user_sessions.get(subject_num)
+            if session is None or session.done:
+                # 終えたセッションのログをまだまとめている途中なら、それが終わるのを待つ
+                # （待たずに作ると、閉じている途中のログを前回落ちたものとして復元してしまう）
+                closing = self.closing_sessions.get(subject_num)
+                if closing is not None:
+                    await asyncio.shield(closing)
+                # ログを開くなどディスクを待つので、セッションはイベントループの外で作る
+                # 作っている間に同じ参加者から来た要求は、そのセッションができるのを待つ
+                pending = self.pending_sessions.get(subject_num)
+                if pending is not None:
+                    session = await asyncio.shield(pending)
+                else:
+                    pending = asyncio.get_running_loop().run_in_executor(
+                        None, Session, self.template, subject_num, self.trial_num, self.zero_mean, self.flush)
+                    self.pending_sessions[subject_num] = pending
+                    try:
+                        session = await pending
+                    finally:
+                        del self.pending_sessions[subject_num]
+                    if not session.done:
+                        self.sessions[session.id] = session
+                    self.user_sessions[subject_num] = session
+            return 200, "application/json", json.dumps(session.State()).encode()
+        if method == "POST" and path == "/click":
+            session = self.sessions.get(params["session"])
+            if session is None:
+                return 404, "application/json", b'{"error": "session"}'
+            if session.Click((int)(params["x"]), (int)(params["y"])):
+                # 最後の試行が終わったらログを閉じて結果ファイルにまとめる（ディスクの同期はイベントループの外で）
+                del self.sessions[session.id]
+                closing = asyncio.get_running_loop().run_in_executor(None, session.store.Close)
+                self.closing_sessions[session.subject_num] = closing
+                closing.add_done_callback(lambda _: self.closing_sessions.pop(session.subject_num, None))
+                await asyncio.shield(closing)
+            return 200, "application/json", json.dumps(session.State()).encode()
+        if method == "GET" and path == "/state":
+            session = self.sessions.get(params["session"])
+            if session is None:
+                return 404, "application/json", b'{"error": "session"}'
+            return 200, "application/json", json.dumps(session.State()).encode()
+        return 404, "text/plain", b"not found"
+
+    # HTTP/1.1（keep-alive）の最小限の実装
+    async def Handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = h.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                body = b""
+                length = (int)(headers.get("content-length", 0))
+                if length > 0:
+                    body = await reader.readexactly(length)
+
+                url = urllib.parse.urlsplit(target)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                params.update(urllib.parse.parse_qsl(body.decode("utf-8", "replace")))
+                try:
+                    status, ctype, payload = await self.Dispatch(method, url.path, params)
+                except (KeyError, ValueError):
+                    status, ctype, payload = 400, "text/plain", b"bad request"
+
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                reason = {200: "OK", 400: "Bad Request", 404: "Not Found"}[status]
+                writer.write((f"{version} {status} {reason}\r\n"
+                              f"Content-Type: {ctype}\r\n"
+                              f"Content-Length: {len(payload)}\r\n"
+                              f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n"
+                              "Cache-Control: no-store\r\n\r\n").encode("latin-1") + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def Close(self):
+        for session in self.user_sessions.values():
+            if not session.done:
+                session.store.Close()
+
+
+async def Serve(server, host, port):
+    s = await asyncio.start_server(server.Handle, host, port)
+    print(f"http://{host}:{port}/?user=<参加者番号> で回答を始められます（Ctrl+Cで終了）")
+    async with s:
+        await s.serve_forever()
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    trial_num = None
+    host = "127.0.0.1"
+    port = 8080
+    size_gain = 1.0
+    zero_mean = True
+    flush = "row"
+
+    try:
+        opts, args = getopt.getopt(argv, 'ht:p:g:z:f:', ['help', 'trial=', 'host=', 'port=', 'gain=', 'zmean=', 'flush='])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit()
+    for opt, arg in opts:
+        try:
+            if opt in ('-h', '--help'):
+                print(usage)
+                sys.exit()
+            elif opt in ('-t', '--trial'):
+                trial_num = int(arg)
+            elif opt == '--host':
+                host = arg
+            elif opt in ('-p', '--port'):
+                port = int(arg)
+            elif opt in ('-g', '--gain'):
+                size_gain = float(arg)
+            elif opt in ('-z', '--zmean'):
+                zero_mean = True if int(arg) != 0 else False
+            elif opt in ('-f', '--flush'):
+                flush = arg if arg in ("row", "exit") else int(arg)
+        except Exception:
+            print('Error parsing argument: %s' % opt)
+            print(usage)
+            sys.exit(2)
+    if trial_num == None or trial_num <= 0:
+        print(usage)
+        sys.exit()
+    server = FormServer(trial_num, size_gain, zero_mean, flush)
+    try:
+        asyncio.run(Serve(server, host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.Close()